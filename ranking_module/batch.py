@@ -0,0 +1,411 @@
+'''
+Модуль пакетного ранжирования больших файлов.
+=============================================
+
+Файл читается частями, выровненными по границам RequestID: все
+предложения одного запроса попадают в одну часть, так как DeltaAmount и
+DeltaFlightTime считаются по запросу целиком. Каждая часть ранжируется
+и дописывается в результат, поэтому память ограничена размером части,
+а не размером файла. Предложения одного запроса в файле должны идти подряд.
+
+Для многоядерных машин запросы распределяются по пулу процессов, каждый
+процесс один раз загружает модель и словари, результат собирается в
+исходном порядке строк и совпадает с последовательным ранжированием.
+
+Функции:
+--------
+read_csv_chunks(name_file, chunk_size) `->` iterator df
+read_excel_chunks(name_file, chunk_size) `->` iterator df
+split_request_chunks(chunks) `->` iterator df
+rank_chunk(df, model, compact) `->` df
+make_request_shards(request_ids, n_shards) `->` list ndarray
+rank_parallel(df, n_jobs, model, shards_per_job, compact) `->` df
+rank_file_streaming(name_file, name_file_result, model, chunk_size, n_jobs, compact) `->` int
+
+Зависимости:
+------------
+argparse
+\ncollections
+\nconcurrent.futures
+\nlogging
+\nnumpy
+\nos
+\nopenpyxl
+\npandas
+\npathlib
+
+Запуск:
+-------
+`python ranking_module/batch.py offers.csv offersResult.csv --chunk-size 50000`
+
+'''
+
+
+# Необходимые библиотеки
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import numpy as np
+import openpyxl
+import os
+import pandas as pd
+from pathlib import Path
+## Внутренние файлы
+from main import make_preds
+from preprocessing import make_compact, make_preprocess
+from resources import resources
+
+
+# Переменные
+logger = logging.getLogger(__name__)
+
+drop_columns = ['Position ( from 1 to n)']
+excel_na_values = ['', 'NULL', 'null', 'NaN', 'nan', 'NA', 'N/A', '#N/A']
+
+# Модель процесса пула
+_worker_model = None
+
+
+def read_csv_chunks(name_file, chunk_size=50000):
+    '''Функция чтения csv файла частями.
+    ====================================
+
+    Параметры:
+    ----------
+    name_file : str или Path
+        путь до файла в формате csv
+    chunk_size : int
+        число строк в части
+
+    Возвращаемые значения:
+    ----------------------
+    iterator df
+        части файла без выравнивания по RequestID
+
+    '''
+    yield from pd.read_csv(name_file, chunksize=chunk_size)
+
+
+def read_excel_chunks(name_file, chunk_size=50000):
+    '''Функция чтения первого листа xlsx файла частями.
+    ===================================================
+
+    Параметры:
+    ----------
+    name_file : str или Path
+        путь до файла в формате xlsx
+    chunk_size : int
+        число строк в части
+
+    Возвращаемые значения:
+    ----------------------
+    iterator df
+        части файла без выравнивания по RequestID
+
+    '''
+    workbook = openpyxl.load_workbook(name_file, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        columns = next(rows)
+        records = []
+        for row in rows:
+            records.append(row)
+            if len(records) == chunk_size:
+                yield _make_excel_chunk(records, columns)
+                records = []
+        if records:
+            yield _make_excel_chunk(records, columns)
+    finally:
+        workbook.close()
+
+
+def _make_excel_chunk(records, columns):
+    '''Сборка части с пропусками и числами, записанными текстом, как в pd.read_excel.'''
+    df = pd.DataFrame.from_records(records, columns=columns)
+    df = df.replace(excel_na_values, np.nan).infer_objects()
+    for column in df.columns[df.dtypes == object]:
+        values = pd.to_numeric(df[column], errors='coerce')
+        if values.notna().sum() == df[column].notna().sum():
+            df[column] = values
+    return df
+
+
+def split_request_chunks(chunks):
+    '''Функция выравнивания частей по границам RequestID.
+    =====================================================
+
+    Последний запрос части переносится в следующую часть.
+
+    Параметры:
+    ----------
+    chunks : iterable df
+        части данных в порядке файла
+
+    Возвращаемые значения:
+    ----------------------
+    iterator df
+        части, содержащие запросы целиком
+
+    '''
+    seen_request_ids = set()
+    carry = None
+
+    for chunk in chunks:
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if chunk.empty:
+            continue
+
+        # Хвост части с последним RequestID
+        request_ids = chunk['RequestID'].to_numpy()
+        is_other = request_ids[::-1] != request_ids[-1]
+        tail_size = is_other.argmax() if is_other.any() else len(chunk)
+
+        carry = chunk.iloc[len(chunk) - tail_size:]
+        ready = chunk.iloc[:len(chunk) - tail_size]
+        if not ready.empty:
+            _check_contiguous(ready, seen_request_ids)
+            yield ready.reset_index(drop=True)
+
+    if carry is not None and not carry.empty:
+        _check_contiguous(carry, seen_request_ids)
+        yield carry.reset_index(drop=True)
+
+
+def _check_contiguous(df, seen_request_ids):
+    '''Проверка, что запросы части не встречались в предыдущих частях.'''
+    request_ids = pd.unique(df['RequestID'])
+    repeated = [request_id for request_id in request_ids if request_id in seen_request_ids]
+    if repeated:
+        raise ValueError(f'Offers of RequestID {repeated[0]} are not contiguous in the file')
+    seen_request_ids.update(request_ids)
+
+
+def rank_chunk(df, model=None, compact=False):
+    '''Функция ранжирования части файла.
+    ====================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        данные запросов и выдачи пользователя
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    compact : bool
+        хранить признаки в компактных типах, см. make_compact
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        с заполненным рейтингом ранжирования Position
+
+    '''
+    df = df.drop(columns=drop_columns, errors='ignore')
+    processed_df = make_preprocess(df, compact=compact)
+    return make_preds(processed_df, model)
+
+
+def make_request_shards(request_ids, n_shards):
+    '''Функция разбиения строк на части по RequestID.
+    =================================================
+
+    Запросы распределяются жадно по наименее загруженной части, все
+    предложения запроса попадают в одну часть.
+
+    Параметры:
+    ----------
+    request_ids : array_like
+        RequestID каждой строки
+    n_shards : int
+        число частей
+
+    Возвращаемые значения:
+    ----------------------
+    list ndarray
+        номера строк каждой непустой части по возрастанию
+
+    '''
+    codes, _ = pd.factorize(np.asarray(request_ids))
+    sizes = np.bincount(codes)
+
+    # Крупные запросы распределяются первыми
+    shard_of_request = np.empty(len(sizes), dtype=np.int64)
+    shard_sizes = np.zeros(n_shards, dtype=np.int64)
+    for request in np.argsort(-sizes, kind='stable'):
+        shard = shard_sizes.argmin()
+        shard_of_request[request] = shard
+        shard_sizes[shard] += sizes[request]
+
+    shard_of_row = shard_of_request[codes]
+    order = np.argsort(shard_of_row, kind='stable')
+    bounds = np.cumsum(np.bincount(shard_of_row, minlength=n_shards))[:-1]
+    return [rows for rows in np.split(order, bounds) if len(rows)]
+
+
+def _init_worker(model, thread_count):
+    '''Загрузка ресурсов один раз на процесс пула.'''
+    global _worker_model
+    _worker_model = model
+    resources.thread_count = thread_count
+    resources.warm_up(model=model is None)
+
+
+def _get_worker_thread_count(n_jobs):
+    '''Потоки модели на процесс пула, чтобы процессы не делили ядра.'''
+    if resources.thread_count != -1:
+        return resources.thread_count
+    return max(1, (os.cpu_count() or 1) // n_jobs)
+
+
+def _rank_shard(df, compact=False):
+    return rank_chunk(df, _worker_model, compact)
+
+
+def rank_parallel(df, n_jobs=None, model=None, shards_per_job=4, compact=False):
+    '''Функция ранжирования на пуле процессов.
+    ==========================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        данные запросов и выдачи пользователя
+    n_jobs : int
+        число процессов, по умолчанию число ядер
+    model : CatBoostClassifier
+        обученная модель, по умолчанию каждый процесс берёт её из resources
+    shards_per_job : int
+        число частей на процесс для выравнивания нагрузки
+    compact : bool
+        хранить признаки в компактных типах, см. make_compact
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        с заполненным рейтингом ранжирования Position, как у rank_chunk
+
+    '''
+    n_jobs = n_jobs or os.cpu_count()
+    shards = make_request_shards(df['RequestID'], n_jobs * shards_per_job)
+    if n_jobs == 1 or len(shards) == 1:
+        return rank_chunk(df, model, compact)
+
+    with ProcessPoolExecutor(n_jobs, initializer=_init_worker,
+                             initargs=(model, _get_worker_thread_count(n_jobs))) as executor:
+        results = list(executor.map(_rank_shard, (df.iloc[rows].reset_index(drop=True) for rows in shards)))
+
+    # Сборка в исходном порядке строк
+    df_result = pd.concat(results, ignore_index=True)
+    order = np.argsort(np.concatenate(shards), kind='stable')
+    df_result = df_result.take(order)
+    df_result.index = pd.RangeIndex(len(df_result), name='index')
+
+    # Типы выбираются по всей таблице, как в rank_chunk: категории и int32/float32
+    # частей могут не совпадать, и concat вернул бы object и float64
+    if compact:
+        df_result = make_compact(df_result)
+    return df_result
+
+
+def _iter_ranked_chunks(chunks, model, n_jobs, compact=False):
+    '''Ранжирование частей по порядку, при n_jobs > 1 на пуле процессов.'''
+    if n_jobs == 1:
+        for df_chunk in chunks:
+            yield rank_chunk(df_chunk, model, compact)
+        return
+
+    with ProcessPoolExecutor(n_jobs, initializer=_init_worker,
+                             initargs=(model, _get_worker_thread_count(n_jobs))) as executor:
+        futures = deque()
+        for df_chunk in chunks:
+            futures.append(executor.submit(_rank_shard, df_chunk, compact))
+            # Не более двух частей на процесс в памяти
+            if len(futures) >= 2 * n_jobs:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+
+def _write_csv_chunk(df, name_file_result, is_first):
+    df.to_csv(name_file_result, mode='w' if is_first else 'a', header=is_first, index=False)
+
+
+def rank_file_streaming(name_file, name_file_result, model=None, chunk_size=50000, n_jobs=1, compact=False):
+    '''Функция потокового ранжирования файла.
+    =========================================
+
+    Параметры:
+    ----------
+    name_file : str или Path
+        путь до файла с предложениями в формате csv или xlsx
+    name_file_result : str или Path
+        путь до файла результата в формате csv или xlsx
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    chunk_size : int
+        число строк, читаемых за раз
+    n_jobs : int
+        число процессов, части ранжируются параллельно
+        и записываются в исходном порядке
+    compact : bool
+        хранить признаки в компактных типах, см. make_compact
+
+    Возвращаемые значения:
+    ----------------------
+    int
+        число записанных строк
+
+    '''
+    suffix = Path(name_file).suffix.lower()
+    if suffix == '.csv':
+        chunks = read_csv_chunks(name_file, chunk_size)
+    elif suffix in ('.xlsx', '.xlsm'):
+        chunks = read_excel_chunks(name_file, chunk_size)
+    else:
+        raise ValueError(f'Unsupported input format: {suffix}')
+
+    suffix_result = Path(name_file_result).suffix.lower()
+    if suffix_result not in ('.csv', '.xlsx'):
+        raise ValueError(f'Unsupported output format: {suffix_result}')
+
+    workbook = None
+    if suffix_result == '.xlsx':
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet()
+
+    rows = 0
+    for df_result in _iter_ranked_chunks(split_request_chunks(chunks), model, n_jobs or os.cpu_count(), compact):
+        if workbook is None:
+            _write_csv_chunk(df_result, name_file_result, is_first=rows == 0)
+        else:
+            if rows == 0:
+                worksheet.append(list(df_result.columns))
+            for row in df_result.astype(object).where(df_result.notna(), None).itertuples(index=False):
+                worksheet.append([value.item() if isinstance(value, np.generic) else value for value in row])
+
+        rows += len(df_result)
+        logger.info(f'Ranked rows: {rows}')
+
+    if workbook is not None:
+        workbook.save(name_file_result)
+
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='Потоковое ранжирование предложений из файла')
+    parser.add_argument('input', help='путь до файла с предложениями в формате csv или xlsx')
+    parser.add_argument('output', help='путь до файла результата в формате csv или xlsx')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='число строк, читаемых за раз')
+    parser.add_argument('--jobs', type=int, default=1, help='число процессов, 0 - по числу ядер')
+    parser.add_argument('--compact', action='store_true', help='хранить признаки в компактных типах')
+    args = parser.parse_args()
+
+    if args.jobs != 1:
+        resources.warm_up()
+    rows = rank_file_streaming(
+        args.input, args.output, chunk_size=args.chunk_size, n_jobs=args.jobs, compact=args.compact
+    )
+    print(f'Работа выполнена, строк: {rows}, ваш файл: {args.output}')
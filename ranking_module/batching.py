@@ -0,0 +1,277 @@
+'''
+Модуль микро-батчинга запросов ранжирования.
+============================================
+
+Конкурентные запросы собираются в одну пачку на время не дольше
+max_wait секунд или до max_batch_size предложений, после чего
+предпроцессинг и predict_proba выполняются один раз на всю пачку,
+а позиции раздаются обратно по запросам.
+
+Классы:
+-------
+MicroBatchScheduler
+
+Зависимости:
+------------
+asyncio
+\nlogging
+\npandas
+\ntime
+
+'''
+
+
+# Необходимые библиотеки
+import asyncio
+import logging
+import pandas as pd
+import time
+## Внутренние файлы
+from main import make_preds
+from preprocessing import make_preprocess
+from resources import resources
+
+
+# Переменные
+logger = logging.getLogger(__name__)
+
+result_columns = ['ID', 'RequestID', 'Position']
+# Столбцы, без которых запрос нельзя поставить в пачку
+required_columns = ['ID', 'RequestID']
+
+
+class MicroBatchScheduler:
+    '''Планировщик, объединяющий конкурентные запросы в пачки.
+    ==========================================================
+
+    Предложения одного RequestID должны приходить в одном вызове rank:
+    вызовы с уже стоящими в пачке RequestID уходят в следующую пачку.
+
+    Параметры:
+    ----------
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    max_batch_size : int
+        максимальное число предложений в пачке
+    max_wait : float
+        максимальное время ожидания пачки в секундах
+    latency_budget : float
+        бюджет времени на оценку пачки моделью в секундах, None - все деревья
+    score_cache : ScoreCache
+        кэш оценок модели для make_preds
+
+    '''
+
+    def __init__(self, model=None, max_batch_size=2000, max_wait=0.005, latency_budget=None, score_cache=None):
+        self.model = model
+        self.score_cache = score_cache
+        self.latency_budget = latency_budget
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._pending_offers = 0
+        self._has_pending = None
+        self._worker = None
+        self._batches = 0
+        self._requests = 0
+        self._offers = 0
+        self._last_batch_size = 0
+        self._max_batch_size_seen = 0
+        self._last_batch_seconds = 0.0
+        self._resources_version = None
+
+    async def start(self):
+        '''Запуск фоновой обработки пачек в текущем цикле событий, перезапуск завершившейся.'''
+        if self._worker is None or self._worker.done():
+            if self._worker is not None and not self._worker.cancelled() and self._worker.exception() is not None:
+                logger.error(f'Batch worker stopped with {self._worker.exception()!r}, restarting')
+            self._has_pending = asyncio.Event()
+            if self._pending:
+                self._has_pending.set()
+            self._worker = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        '''Остановка обработки после завершения стоящих в очереди запросов.'''
+        if self._worker is not None:
+            while self._pending:
+                await asyncio.sleep(self.max_wait)
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def rank(self, df):
+        '''Ранжирование предложений одного или нескольких запросов.
+        ===========================================================
+
+        Параметры:
+        ----------
+        df : DataFrame
+            данные запроса и выдачи пользователя
+
+        Возвращаемые значения:
+        ----------------------
+        df : DataFrame
+            с полями ID, RequestID, Position в порядке входных строк
+
+        '''
+        missing_columns = [column for column in required_columns if column not in df]
+        if missing_columns:
+            raise KeyError(', '.join(missing_columns))
+
+        await self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((df, future))
+        self._pending_offers += len(df)
+        self._has_pending.set()
+        return await future
+
+    def get_metrics(self):
+        '''Метрики очереди и размеров пачек.
+        ====================================
+
+        Возвращаемые значения:
+        ----------------------
+        dict
+            queue_depth - запросов в очереди, queued_offers - предложений в очереди,
+            batches, requests, offers - обработано всего,
+            last_batch_size, max_batch_size, mean_batch_size - размеры пачек в предложениях,
+            last_batch_seconds - время обработки последней пачки,
+            resources_version - версия ресурсов последней пачки
+
+        '''
+        return {
+            'queue_depth': len(self._pending),
+            'queued_offers': self._pending_offers,
+            'batches': self._batches,
+            'requests': self._requests,
+            'offers': self._offers,
+            'last_batch_size': self._last_batch_size,
+            'max_batch_size': self._max_batch_size_seen,
+            'mean_batch_size': self._offers / self._batches if self._batches else 0.0,
+            'last_batch_seconds': self._last_batch_seconds,
+            'resources_version': self._resources_version,
+        }
+
+    def _take_batch(self):
+        '''Выбор запросов в пачку с учётом размера и совпадающих RequestID.'''
+        batch = []
+        batch_size = 0
+        request_ids = set()
+        while self._pending:
+            df, future = self._pending[0]
+            try:
+                df_request_ids = set(df['RequestID'].unique())
+            except Exception as error:
+                # Ошибка одного запроса не должна останавливать обработку
+                self._pending.pop(0)
+                self._pending_offers -= len(df)
+                if not future.done():
+                    future.set_exception(error)
+                continue
+            if batch and (batch_size + len(df) > self.max_batch_size or request_ids & df_request_ids):
+                break
+            self._pending.pop(0)
+            self._pending_offers -= len(df)
+            batch.append((df, future))
+            batch_size += len(df)
+            request_ids |= df_request_ids
+        if not self._pending:
+            self._has_pending.clear()
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._has_pending.wait()
+
+            # Ошибка итерации завершает только запросы её пачки
+            batch = []
+            try:
+                # Ожидание наполнения пачки
+                deadline = loop.time() + self.max_wait
+                while self._pending_offers < self.max_batch_size and loop.time() < deadline:
+                    await asyncio.sleep(min(self.max_wait / 4, deadline - loop.time()))
+
+                batch = self._take_batch()
+                batch = [(df, future) for df, future in batch if not future.cancelled()]
+                if not batch:
+                    continue
+
+                start = time.perf_counter()
+                try:
+                    results = await loop.run_in_executor(None, self._rank_batch, [df for df, _ in batch])
+                except Exception as error:
+                    logger.exception('Batch ranking failed')
+                    results = [error] * len(batch)
+                self._last_batch_seconds = time.perf_counter() - start
+
+                for (df, future), result in zip(batch, results):
+                    if future.done():
+                        continue
+                    if isinstance(result, Exception):
+                        future.set_exception(result)
+                    else:
+                        future.set_result(result)
+            except Exception as error:
+                logger.exception('Batch worker iteration failed')
+                for df, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+
+    def _rank_batch(self, dfs):
+        '''Ранжирование пачки, при ошибке запросы ранжируются по отдельности.'''
+        batch_size = sum(len(df) for df in dfs)
+        self._batches += 1
+        self._requests += len(dfs)
+        self._offers += batch_size
+        self._last_batch_size = batch_size
+        self._max_batch_size_seen = max(self._max_batch_size_seen, batch_size)
+
+        try:
+            df_result = self._rank(pd.concat(dfs, ignore_index=True))
+            if len(df_result) != batch_size:
+                raise ValueError(f'Batch result has {len(df_result)} rows, expected {batch_size}')
+        except Exception:
+            if len(dfs) == 1:
+                raise
+            logger.warning('Batch ranking failed, ranking requests one by one')
+            results = []
+            for df in dfs:
+                try:
+                    results.append(self._rank(df))
+                except Exception as error:
+                    results.append(error)
+            return results
+
+        # Разделение результата по исходным запросам
+        results = []
+        offset = 0
+        for df in dfs:
+            results.append(df_result.iloc[offset:offset + len(df)].reset_index(drop=True))
+            offset += len(df)
+        return results
+
+    def _rank(self, df):
+        # Версия ресурсов фиксируется на всю пачку, reload подменит её только для следующих
+        model, time_zone_dictionary, model_version = self.model, None, None
+        if model is None:
+            snapshot = resources.snapshot()
+            model, time_zone_dictionary = snapshot.model, snapshot.time_zone_dictionary
+            model_version = snapshot.version
+            self._resources_version = snapshot.version
+        processed_df = make_preprocess(df, time_zone_dictionary=time_zone_dictionary)
+        df_result = make_preds(
+            processed_df, model, latency_budget=self.latency_budget, score_cache=self.score_cache,
+            model_version=model_version
+        )
+        return df_result[result_columns].reset_index(drop=True)
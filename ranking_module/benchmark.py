@@ -0,0 +1,359 @@
+'''
+Модуль нагрузочного тестирования предпроцессинга и ранжирования.
+================================================================
+
+Синтетические запросы строятся по аэропортам и городам из словаря
+Locations_UTC.xlsx: маршруты в одну сторону и туда-обратно, заданное
+число предложений на запрос. Для каждой стадии (make_preprocess,
+make_preds, весь конвейер) и размера пачки замеряются пропускная
+способность, задержка p50/p99 и пиковая память. Каждая стадия
+вызывается samples раз или до исчерпания time_limit секунд; p99 считается
+только по 100 и более вызовам, иначе в результате только p50 и max.
+Результат сохраняется в json, два результата можно сравнить между ревизиями.
+
+Функции:
+--------
+make_synthetic_offers(n_requests, offers_per_request, return_share, seed) `->` df
+run_benchmark(batch_sizes, offers_per_request, samples, time_limit, seed) `->` dict
+compare_results(result, result_base) `->` df
+check_memory_budget(result, memory_budget, stage, min_batch_size) `->` list dict
+
+Зависимости:
+------------
+argparse
+\ndatetime
+\njson
+\nnumpy
+\npandas
+\nplatform
+\nsubprocess
+\nsys
+\ntime
+\ntracemalloc
+
+Запуск:
+-------
+`python ranking_module/benchmark.py --output bench.json`
+\n`python ranking_module/benchmark.py --batch-sizes 100000 --memory-budget 64` - код
+выхода 1, если пиковая память make_preprocess на 100000 предложений больше 64 MB
+\n`python ranking_module/benchmark.py --output new.json --compare bench.json`
+
+'''
+
+
+# Необходимые библиотеки
+import argparse
+from datetime import datetime
+import json
+import numpy as np
+import pandas as pd
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+## Внутренние файлы
+from main import make_preds
+from preprocessing import make_preprocess
+from resources import base_path, resources
+
+
+# Переменные
+batch_sizes = [1, 10, 100, 1000, 10000, 100000]
+date_format = '%Y-%m-%d %H:%M:%S.000'
+carriers = ['SU', 'S7', 'DP', 'U6', 'UT', 'FV', 'N4', 'KC', 'HY', 'TK']
+# Допустимая пиковая память make_preprocess в MB на 100000 предложений
+memory_budget = 64
+# Минимальное число замеров для p99
+p99_min_samples = 100
+
+
+def make_synthetic_offers(n_requests, offers_per_request=50, return_share=0.5, seed=0):
+    '''Функция генерации синтетических запросов и предложений.
+    ==========================================================
+
+    Параметры:
+    ----------
+    n_requests : int
+        число запросов
+    offers_per_request : int
+        число предложений на запрос
+    return_share : float
+        доля запросов туда-обратно
+    seed : int
+        зерно генератора случайных чисел
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        данные в формате входного файла агента
+
+    '''
+    rng = np.random.default_rng(seed)
+    time_zone_dictionary = resources.time_zone_dictionary
+    codes = time_zone_dictionary.index.to_numpy()
+    time_zones = time_zone_dictionary.to_numpy()
+
+    # Параметры запросов
+    origin = rng.integers(len(codes), size=n_requests)
+    destination = (origin + rng.integers(1, len(codes), size=n_requests)) % len(codes)
+    is_return = rng.random(n_requests) < return_share
+    request_date = pd.Timestamp('2022-06-01') + pd.to_timedelta(rng.integers(0, 180 * 24 * 60, n_requests), unit='m')
+    departure_day = request_date.normalize() + pd.to_timedelta(rng.integers(1, 60, n_requests), unit='D')
+    # Половина запросов без указания времени вылета
+    request_departure = departure_day + pd.to_timedelta(
+        np.where(rng.random(n_requests) < 0.5, 0, rng.integers(6, 22, n_requests) * 60), unit='m'
+    )
+    request_return = departure_day + pd.to_timedelta(rng.integers(1, 14, n_requests), unit='D')
+
+    route = np.char.add(codes[origin].astype(str), codes[destination].astype(str))
+    back_route = np.char.add(codes[destination].astype(str), codes[origin].astype(str))
+    search_route = np.where(is_return, np.char.add(np.char.add(route, '/'), back_route), route)
+
+    # Параметры предложений
+    n = n_requests * offers_per_request
+    request = np.repeat(np.arange(n_requests), offers_per_request)
+    zone_shift = pd.to_timedelta(time_zones[destination[request]] - time_zones[origin[request]], unit='h')
+
+    duration = pd.to_timedelta(rng.integers(60, 20 * 60, n) // 5 * 5, unit='m')
+    departure = request_departure[request].normalize() + pd.to_timedelta(rng.integers(0, 24 * 12, n) * 5, unit='m')
+    arrival = departure + duration + zone_shift
+
+    back_duration = pd.to_timedelta(rng.integers(60, 20 * 60, n) // 5 * 5, unit='m')
+    return_departure = request_return[request].normalize() + pd.to_timedelta(rng.integers(0, 24 * 12, n) * 5, unit='m')
+    return_arrival = return_departure + back_duration - zone_shift
+
+    has_return = is_return[request]
+    flight_number = pd.Series(rng.choice(carriers, n)).str.cat(
+        pd.Series(rng.integers(100, 9999, n)).astype(str).str.zfill(4)
+    )
+
+    refund = rng.choice([0.0, 1.0, np.nan], n, p=[0.6, 0.3, 0.1])
+
+    df = pd.DataFrame({
+        'ID': np.arange(1, n + 1),
+        'RequestID': 1000000 + request,
+        'EmployeeId': rng.integers(1, 5000, n_requests)[request],
+        'RequestDate': request_date[request].strftime(date_format),
+        'ClientID': rng.integers(1, 3000, n_requests)[request],
+        'ValueRu': np.nan,
+        'SearchRoute': search_route[request],
+        'RequestDepartureDate': request_departure[request].strftime(date_format),
+        'RequestReturnDate': pd.Series(request_return[request].strftime(date_format)).where(has_return),
+        'FligtOption': flight_number + ' ' + route[request] + ' ' + departure.strftime('%Y.%m.%d'),
+        'DepartureDate': departure.strftime(date_format),
+        'ArrivalDate': arrival.strftime(date_format),
+        'ReturnDepatrureDate': pd.Series(return_departure.strftime(date_format)).where(has_return),
+        'ReturnArrivalDate': pd.Series(return_arrival.strftime(date_format)).where(has_return),
+        'SegmentCount': rng.integers(1, 4, n) * np.where(has_return, 2, 1),
+        'Amount': np.round(rng.lognormal(10.3, 0.5, n), -1),
+        'class': rng.choice(['E', 'B'], n, p=[0.9, 0.1]),
+        'IsBaggage': rng.integers(0, 2, n),
+        'isRefundPermitted': refund,
+        'isExchangePermitted': np.where(np.isnan(refund), np.nan, rng.integers(0, 2, n)),
+        'isDiscount': rng.integers(0, 2, n),
+        'InTravelPolicy': rng.integers(0, 2, n),
+    })
+    return df
+
+
+def _measure(function, df, samples, time_limit):
+    '''Замер задержки и пиковой памяти функции.'''
+    latencies = []
+    deadline = time.perf_counter() + time_limit
+    while len(latencies) < samples and (not latencies or time.perf_counter() < deadline):
+        start = time.perf_counter()
+        function(df)
+        latencies.append(time.perf_counter() - start)
+
+    # Память замеряется отдельным запуском, tracemalloc замедляет работу
+    tracemalloc.start()
+    try:
+        function(df)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'samples': len(latencies),
+        'p50_ms': float(np.percentile(latencies, 50) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000) if len(latencies) >= p99_min_samples else None,
+        'max_ms': float(latencies.max() * 1000),
+        'throughput_offers_per_s': float(len(df) / np.median(latencies)),
+        'peak_memory_mb': peak_memory / 2 ** 20,
+    }
+
+
+def _get_revision():
+    '''Текущая ревизия git, если она доступна.'''
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=base_path, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(batch_sizes=batch_sizes, offers_per_request=50, samples=200, time_limit=10.0, seed=0):
+    '''Функция нагрузочного тестирования стадий конвейера.
+    ======================================================
+
+    Параметры:
+    ----------
+    batch_sizes : list
+        размеры пачек в предложениях
+    offers_per_request : int
+        число предложений на запрос
+    samples : int
+        число вызовов каждой стадии для замера задержки
+    time_limit : float
+        время на замер задержки стадии в секундах: после него вызовы
+        прекращаются, даже если samples не набрано, но хотя бы один
+        вызов выполняется
+    seed : int
+        зерно генератора данных
+
+    Возвращаемые значения:
+    ----------------------
+    dict
+        окружение и результаты по стадиям и размерам пачек; p99_ms -
+        None, если вызовов меньше p99_min_samples
+
+    '''
+    try:
+        model = resources.model
+    except (OSError, ValueError) as error:
+        print(f'Модель не загружена, стадия make_preds пропущена: {error}')
+        model = None
+
+    results = []
+    for batch_size in batch_sizes:
+        offers = min(offers_per_request, batch_size)
+        n_requests = max(1, batch_size // offers)
+        df = make_synthetic_offers(n_requests, offers, seed=seed)
+
+        # make_preprocess не меняет входной df, копии для замеров не нужны
+        stages = {'make_preprocess': make_preprocess}
+        if model is not None:
+            processed_df = make_preprocess(df)
+            stages['make_preds'] = lambda df: make_preds(processed_df, model)
+            stages['total'] = lambda df: make_preds(make_preprocess(df), model)
+
+        for stage, function in stages.items():
+            measure = _measure(function, df, samples, time_limit)
+            results.append({'stage': stage, 'batch_size': len(df), 'requests': n_requests, **measure})
+            p99 = f"{measure['p99_ms']:10.1f}" if measure['p99_ms'] is not None else f"{'-':>10}"
+            print(
+                f"{stage:>16} {len(df):>8} offers: p50 {measure['p50_ms']:10.1f} ms, p99 {p99} ms, "
+                f"max {measure['max_ms']:10.1f} ms ({measure['samples']:>3} calls), "
+                f"{measure['throughput_offers_per_s']:12.0f} offers/s, peak {measure['peak_memory_mb']:8.1f} MB"
+            )
+
+    return {
+        'revision': _get_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'offers_per_request': offers_per_request,
+        'results': results,
+    }
+
+
+def compare_results(result, result_base):
+    '''Функция сравнения двух запусков нагрузочного теста.
+    ======================================================
+
+    Параметры:
+    ----------
+    result : dict
+        новый результат run_benchmark
+    result_base : dict
+        базовый результат run_benchmark
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        отношения новых значений к базовым по стадиям и размерам пачек,
+        для задержки и памяти больше 1 - хуже, для пропускной способности - лучше;
+        p99_ms без достаточного числа замеров - пропуск
+
+    '''
+    metrics = ['p50_ms', 'p99_ms', 'max_ms', 'throughput_offers_per_s', 'peak_memory_mb']
+    # В результатах прежних ревизий может не быть части метрик
+    df = pd.DataFrame(result['results']).set_index(['stage', 'batch_size']).reindex(columns=metrics)
+    df_base = pd.DataFrame(result_base['results']).set_index(['stage', 'batch_size']).reindex(columns=metrics)
+    return (df / df_base).dropna(how='all')
+
+
+def check_memory_budget(result, memory_budget=memory_budget, stage='make_preprocess', min_batch_size=10000):
+    '''Функция проверки пиковой памяти стадии.
+    =========================================
+
+    Параметры:
+    ----------
+    result : dict
+        результат run_benchmark
+    memory_budget : float
+        допустимая пиковая память в MB на 100000 предложений
+    stage : str
+        проверяемая стадия
+    min_batch_size : int
+        меньшие пачки не проверяются, в них память определяется
+        постоянными расходами, а не числом предложений
+
+    Возвращаемые значения:
+    ----------------------
+    list dict
+        замеры, превысившие бюджет, с полем peak_memory_mb_per_100k
+
+    '''
+    violations = []
+    for record in result['results']:
+        if record['stage'] != stage or record['batch_size'] < min_batch_size:
+            continue
+        peak_per_100k = record['peak_memory_mb'] * 100000 / record['batch_size']
+        if peak_per_100k > memory_budget:
+            violations.append({**record, 'peak_memory_mb_per_100k': peak_per_100k})
+    return violations
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Нагрузочное тестирование предпроцессинга и ранжирования')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=batch_sizes, help='размеры пачек в предложениях')
+    parser.add_argument('--offers-per-request', type=int, default=50, help='число предложений на запрос')
+    parser.add_argument('--samples', type=int, default=200, help='число вызовов стадии для замера задержки')
+    parser.add_argument('--time-limit', type=float, default=10.0, help='время на замер задержки стадии в секундах')
+    parser.add_argument('--seed', type=int, default=0, help='зерно генератора данных')
+    parser.add_argument('--output', default=None, help='путь для сохранения результата в json')
+    parser.add_argument('--compare', default=None, help='путь до базового результата в json')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help=f'допустимая пиковая память make_preprocess в MB на 100000 предложений, '
+                             f'согласованное значение {memory_budget}')
+    args = parser.parse_args()
+
+    result = run_benchmark(args.batch_sizes, args.offers_per_request, args.samples, args.time_limit, args.seed)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(result, file, indent=2)
+        print(f'Результат сохранён: {args.output}')
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            result_base = json.load(file)
+        print(f"Сравнение с ревизией {result_base.get('revision')}:")
+        print(compare_results(result, result_base).round(3).to_string())
+
+    if args.memory_budget is not None:
+        violations = check_memory_budget(result, args.memory_budget)
+        for record in violations:
+            print(
+                f"Пиковая память make_preprocess на {record['batch_size']} предложений: "
+                f"{record['peak_memory_mb_per_100k']:.1f} MB на 100000 при бюджете {args.memory_budget} MB"
+            )
+        if violations:
+            sys.exit(1)
+        print(f'Пиковая память make_preprocess в пределах бюджета {args.memory_budget} MB на 100000 предложений')
@@ -0,0 +1,116 @@
+'''
+Модуль подбора числа деревьев модели.
+=====================================
+
+На отложенной выборке ранжирование первыми ntree_end деревьями
+(и, при необходимости, с досчётом всех деревьев для первых refine_k
+предложений запроса) сравнивается с полной моделью: время оценки
+и совпадение позиций, первых мест и первых k предложений. По таблице
+выбирается ntree_end или latency_budget для make_preds.
+
+Функции:
+--------
+calibrate_tree_count(df, model, tree_counts, k, refine_k, refine_margin, repeats) `->` df
+
+Зависимости:
+------------
+argparse
+\nnumpy
+\npandas
+\ntime
+
+Запуск:
+-------
+`python ranking_module/calibration.py held_out.csv --trees 100 250 500 1000 --refine-k 3`
+
+'''
+
+
+# Необходимые библиотеки
+import argparse
+import numpy as np
+import pandas as pd
+import time
+## Внутренние файлы
+from files import read_offers_file
+from main import get_ranking_agreement, make_preds
+from preprocessing import make_preprocess
+from resources import resources
+
+
+def _measure_preds(df, model, repeats, **kwargs):
+    '''Позиции make_preds и медианное время вызова в секундах.'''
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        positions = make_preds(df, model, **kwargs)['Position'].to_numpy()
+        seconds.append(time.perf_counter() - start)
+    return positions, float(np.median(seconds))
+
+
+def calibrate_tree_count(df, model=None, tree_counts=None, k=3, refine_k=None, refine_margin=0.25, repeats=3):
+    '''Функция сравнения усечённой модели с полной.
+    ===============================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess на отложенной выборке
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    tree_counts : list
+        проверяемые значения ntree_end, по умолчанию от 1/16 до 1/2 модели
+    k : int
+        число первых позиций для сравнения
+    refine_k : int
+        досчитывать все деревья для первых refine_k предложений запроса,
+        None - без уточнения
+    refine_margin : float
+        запас до границы первых refine_k в единицах RawFormulaVal
+    repeats : int
+        число повторов замера времени
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        по строке на ntree_end и полная модель: seconds, speedup
+        и метрики get_ranking_agreement
+
+    '''
+    if model is None:
+        model = resources.model
+    if tree_counts is None:
+        tree_counts = [max(1, model.tree_count_ // divisor) for divisor in (16, 8, 4, 2)]
+
+    positions, seconds_full = _measure_preds(df, model, repeats)
+    rows = [{'ntree_end': model.tree_count_, 'seconds': seconds_full, 'speedup': 1.0,
+             **get_ranking_agreement(positions, positions, k)}]
+    for ntree_end in sorted(tree_counts):
+        if ntree_end >= model.tree_count_:
+            continue
+        positions_truncated, seconds = _measure_preds(
+            df, model, repeats, ntree_end=ntree_end, refine_k=refine_k, refine_margin=refine_margin
+        )
+        rows.append({'ntree_end': ntree_end, 'seconds': seconds, 'speedup': seconds_full / seconds,
+                     **get_ranking_agreement(positions, positions_truncated, k)})
+
+    return pd.DataFrame(rows).sort_values('ntree_end', ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Подбор числа деревьев модели на отложенной выборке')
+    parser.add_argument('input', help='файл с предложениями в формате csv, parquet или xlsx')
+    parser.add_argument('--trees', type=int, nargs='+', default=None, help='проверяемые значения ntree_end')
+    parser.add_argument('--k', type=int, default=3, help='число первых позиций для сравнения')
+    parser.add_argument('--refine-k', type=int, default=None, help='досчитывать все деревья для первых k предложений')
+    parser.add_argument('--refine-margin', type=float, default=0.25, help='запас до границы первых k предложений')
+    parser.add_argument('--repeats', type=int, default=3, help='число повторов замера времени')
+    parser.add_argument('--output', default=None, help='путь для сохранения таблицы в csv')
+    args = parser.parse_args()
+
+    df = make_preprocess(read_offers_file(args.input))
+    result = calibrate_tree_count(df, tree_counts=args.trees, k=args.k, refine_k=args.refine_k,
+                                  refine_margin=args.refine_margin, repeats=args.repeats)
+    print(result.to_string(index=False))
+    if args.output:
+        result.to_csv(args.output, index=False)
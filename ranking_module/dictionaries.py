@@ -0,0 +1,292 @@
+'''
+Модуль загрузки словарей городов и аэропортов.
+==============================================
+
+Словари читаются из xlsx только при изменении файла, в остальное время
+из бинарного кэша в формате npz рядом с исходным файлом.
+
+Функции:
+--------
+get_cache_path(name_file_dictionary) `->` Path
+get_file_hash(name_file) `->` str
+build_dictionary_cache(name_file_dictionary, name_file_cache) `->` df, df
+load_dictionaries(name_file_dictionary, name_file_cache) `->` df, df
+make_time_zone_dictionary(df_city, df_airport) `->` Series
+
+Переменные:
+-----------
+city_columns
+\nairport_columns
+
+Зависимости:
+------------
+argparse
+\nhashlib
+\nlogging
+\nnumpy
+\nos
+\npandas
+\npathlib
+
+Запуск:
+-------
+`python ranking_module/dictionaries.py ranking_module/Locations_UTC.xlsx`
+пересобирает кэш словарей
+
+'''
+
+
+# Необходимые библиотеки
+import argparse
+import hashlib
+import logging
+import numpy as np
+import os
+import pandas as pd
+from pathlib import Path
+
+
+# Переменные
+# Идентификаторы могут отсутствовать: Int64 с пропусками, в кэше - float64 с NaN
+city_columns = {'Id': 'Int64', 'IataCode': str, 'TimeZone': np.float64}
+airport_columns = {'IATACode': str, 'CityID': 'Int64'}
+cache_version = 2
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache_path(name_file_dictionary):
+    '''Функция получения пути до кэша словарей.
+    ===========================================
+
+    Параметры:
+    ----------
+    name_file_dictionary : str или Path
+        путь до словаря городов и аэропортов в формате xlsx
+
+    Возвращаемые значения:
+    ----------------------
+    Path
+        путь до кэша в формате npz рядом со словарём
+
+    '''
+    return Path(name_file_dictionary).with_suffix('.npz')
+
+
+def get_file_hash(name_file):
+    '''Функция вычисления хэша sha256 содержимого файла.
+    ====================================================
+
+    Параметры:
+    ----------
+    name_file : str или Path
+        путь до файла
+
+    Возвращаемые значения:
+    ----------------------
+    str
+        хэш в шестнадцатеричном виде
+
+    '''
+    file_hash = hashlib.sha256()
+    with open(name_file, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def _to_arrays(df, columns, prefix):
+    '''Перевод столбцов словаря в массивы numpy без объектов python.'''
+    arrays = {}
+    for column, dtype in columns.items():
+        if dtype is str:
+            arrays[prefix + column] = df[column].fillna('').astype(str).to_numpy(dtype=str)
+        elif dtype == 'Int64':
+            arrays[prefix + column] = df[column].astype(dtype).to_numpy(dtype=np.float64, na_value=np.nan)
+        else:
+            arrays[prefix + column] = df[column].to_numpy(dtype=dtype)
+    return arrays
+
+
+def _from_arrays(data, columns, prefix):
+    '''Сборка словаря из массивов кэша.'''
+    df = pd.DataFrame({column: data[prefix + column] for column in columns})
+    for column, dtype in columns.items():
+        if dtype is str:
+            df[column] = df[column].astype(object).where(df[column] != '', np.nan)
+        elif dtype == 'Int64':
+            df[column] = df[column].astype(dtype)
+    return df
+
+
+def _write_cache(name_file_cache, df_city, df_airport, stat, file_hash):
+    '''Атомарная запись кэша словарей.'''
+    name_file_cache = Path(name_file_cache)
+    name_file_temp = name_file_cache.with_name(name_file_cache.name + f'.{os.getpid()}.tmp')
+    with open(name_file_temp, 'wb') as file:
+        np.savez(
+            file,
+            cache_version=np.int64(cache_version),
+            source_size=np.int64(stat.st_size),
+            source_mtime_ns=np.int64(stat.st_mtime_ns),
+            source_hash=np.array(file_hash),
+            **_to_arrays(df_city, city_columns, 'city_'),
+            **_to_arrays(df_airport, airport_columns, 'airport_')
+        )
+    os.replace(name_file_temp, name_file_cache)
+
+
+def build_dictionary_cache(name_file_dictionary, name_file_cache=None):
+    '''Функция сборки кэша словарей из xlsx.
+    ========================================
+
+    Параметры:
+    ----------
+    name_file_dictionary : str или Path
+        путь до словаря городов и аэропортов в формате xlsx
+    name_file_cache : str или Path
+        путь до кэша, по умолчанию рядом со словарём
+
+    Возвращаемые значения:
+    ----------------------
+    df_city : DataFrame
+        справочник городов с полями Id, IataCode, TimeZone
+    df_airport : DataFrame
+        справочник аэропортов с полями IATACode, CityID
+
+    '''
+    if name_file_cache is None:
+        name_file_cache = get_cache_path(name_file_dictionary)
+
+    stat = os.stat(name_file_dictionary)
+    file_hash = get_file_hash(name_file_dictionary)
+
+    xl = pd.ExcelFile(name_file_dictionary)
+    df_city = xl.parse('City', usecols=list(city_columns), dtype={'Id': 'Int64'})
+    df_airport = xl.parse('Airport', usecols=list(airport_columns), dtype={'CityID': 'Int64'})
+    xl.close()
+
+    # Строки без идентификатора остаются: код города и часовой пояс ещё нужны
+    missing_ids = df_city['Id'].isna().sum(), df_airport['CityID'].isna().sum()
+    if any(missing_ids):
+        logger.warning(
+            f'Dictionary has {missing_ids[0]} cities without Id and {missing_ids[1]} airports without CityID'
+        )
+
+    try:
+        _write_cache(name_file_cache, df_city, df_airport, stat, file_hash)
+        logger.info(f'Dictionary cache built: {name_file_cache}')
+    except OSError as error:
+        logger.warning(f'Dictionary cache not written: {error}')
+
+    return df_city, df_airport
+
+
+def load_dictionaries(name_file_dictionary, name_file_cache=None):
+    '''Функция загрузки словарей городов и аэропортов.
+    ==================================================
+
+    Кэш используется, если совпадают размер и время изменения словаря
+    или, при их расхождении, хэш содержимого. Иначе кэш пересобирается.
+
+    Параметры:
+    ----------
+    name_file_dictionary : str или Path
+        путь до словаря городов и аэропортов в формате xlsx
+    name_file_cache : str или Path
+        путь до кэша, по умолчанию рядом со словарём
+
+    Возвращаемые значения:
+    ----------------------
+    df_city : DataFrame
+        справочник городов с полями Id, IataCode, TimeZone
+    df_airport : DataFrame
+        справочник аэропортов с полями IATACode, CityID
+
+    '''
+    if name_file_cache is None:
+        name_file_cache = get_cache_path(name_file_dictionary)
+
+    if not Path(name_file_cache).exists():
+        return build_dictionary_cache(name_file_dictionary, name_file_cache)
+
+    stat = os.stat(name_file_dictionary)
+    with np.load(name_file_cache, allow_pickle=False) as data:
+        if int(data['cache_version']) != cache_version:
+            return build_dictionary_cache(name_file_dictionary, name_file_cache)
+
+        is_same_file = int(data['source_size']) == stat.st_size \
+            and int(data['source_mtime_ns']) == stat.st_mtime_ns
+        file_hash = str(data['source_hash'])
+        if not is_same_file and get_file_hash(name_file_dictionary) != file_hash:
+            return build_dictionary_cache(name_file_dictionary, name_file_cache)
+
+        df_city = _from_arrays(data, city_columns, 'city_')
+        df_airport = _from_arrays(data, airport_columns, 'airport_')
+
+    # Файл был перезаписан без изменений, обновляем время в кэше
+    if not is_same_file:
+        try:
+            _write_cache(name_file_cache, df_city, df_airport, stat, file_hash)
+        except OSError as error:
+            logger.warning(f'Dictionary cache not updated: {error}')
+
+    return df_city, df_airport
+
+
+def make_time_zone_dictionary(df_city, df_airport):
+    '''Функция построения справочника часовых поясов по IATA коду.
+    ==============================================================
+
+    Для кода города часовой пояс берётся из справочника городов,
+    для кода аэропорта - из справочника городов по CityID аэропорта.
+
+    Параметры:
+    ----------
+    df_city : DataFrame
+        справочник городов с полями Id, IataCode, TimeZone
+    df_airport : DataFrame
+        справочник аэропортов с полями IATACode, CityID
+
+    Возвращаемые значения:
+    ----------------------
+    time_zone_dictionary : Series
+        часовой пояс с уникальным индексом по IATA коду
+
+    '''
+    # Часовые пояса городов
+    df_city_time_zone = df_city.loc[
+        df_city['IataCode'].notna() & df_city['TimeZone'].notna(), ['IataCode', 'TimeZone']
+    ]
+    time_zone_city = df_city_time_zone.drop_duplicates(subset='IataCode') \
+        .set_index('IataCode')['TimeZone']
+
+    # Часовые пояса аэропортов через город аэропорта
+    df_airport_time_zone = df_airport[['IATACode', 'CityID']].dropna().merge(
+        df_city[['Id', 'TimeZone']],
+        left_on='CityID',
+        right_on='Id',
+        how='inner'
+    )
+    df_airport_time_zone = df_airport_time_zone[df_airport_time_zone['TimeZone'].notna()]
+    time_zone_airport = df_airport_time_zone.drop_duplicates(subset='IATACode') \
+        .set_index('IATACode')['TimeZone']
+
+    # Код города приоритетнее кода аэропорта
+    time_zone_airport = time_zone_airport[~time_zone_airport.index.isin(time_zone_city.index)]
+    time_zone_dictionary = pd.concat([time_zone_city, time_zone_airport])
+    time_zone_dictionary.index.name = 'IataCode'
+
+    return time_zone_dictionary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description='Сборка кэша словарей городов и аэропортов')
+    parser.add_argument('dictionary', help='путь до словаря в формате xlsx')
+    parser.add_argument('--cache', default=None, help='путь до кэша в формате npz')
+    args = parser.parse_args()
+
+    df_city, df_airport = build_dictionary_cache(args.dictionary, args.cache)
+    print(f'Кэш словарей собран: городов {len(df_city)}, аэропортов {len(df_airport)}')
@@ -0,0 +1,248 @@
+'''
+Модуль ранжирования файлов агента.
+==================================
+
+Файлы читаются, ранжируются и записываются конвейером из трёх потоков:
+пока ранжируется один файл, следующий уже читается, а предыдущий
+записывается. Очереди между потоками ограничены, в памяти одновременно
+находится не больше нескольких файлов. Формат определяется по
+расширению: csv, parquet (нужен pyarrow) или xlsx.
+
+Функции:
+--------
+expand_inputs(patterns) `->` list Path
+get_result_path(path, output, output_format) `->` Path
+read_offers_file(path) `->` df
+write_result_file(df, path)
+rank_files(paths, output, output_format, model, queue_size) `->` list dict
+
+Зависимости:
+------------
+glob
+\nlogging
+\npandas
+\npathlib
+\npyarrow - только для parquet
+\nqueue
+\nthreading
+
+Запуск:
+-------
+`python ranking_module/main.py agents/ --output results/ --format csv`
+
+'''
+
+
+# Необходимые библиотеки
+import glob
+import logging
+import pandas as pd
+from pathlib import Path
+import queue
+import threading
+## Внутренние файлы
+from main import make_preds
+from preprocessing import make_preprocess
+
+
+# Переменные
+logger = logging.getLogger(__name__)
+
+drop_columns = ['Position ( from 1 to n)']
+file_formats = {'.csv': 'csv', '.parquet': 'parquet', '.pq': 'parquet', '.xlsx': 'xlsx', '.xlsm': 'xlsx'}
+
+
+def _get_format(path):
+    '''Формат файла по расширению.'''
+    suffix = Path(path).suffix.lower()
+    if suffix not in file_formats:
+        raise ValueError(f'Unsupported file format: {suffix}')
+    return file_formats[suffix]
+
+
+def expand_inputs(patterns):
+    '''Функция получения списка входных файлов.
+    ===========================================
+
+    Параметры:
+    ----------
+    patterns : list
+        пути до файлов, каталогов или шаблоны glob, из каталогов
+        берутся файлы поддерживаемых форматов
+
+    Возвращаемые значения:
+    ----------------------
+    list Path
+        файлы без повторов в порядке аргументов, внутри каталога
+        и шаблона по имени
+
+    '''
+    paths = []
+    for pattern in patterns:
+        if Path(pattern).is_dir():
+            matches = sorted(path for path in Path(pattern).iterdir()
+                             if path.is_file() and path.suffix.lower() in file_formats)
+        elif glob.has_magic(pattern):
+            matches = sorted(Path(path) for path in glob.glob(pattern, recursive=True) if Path(path).is_file())
+        else:
+            matches = [Path(pattern)]
+        paths.extend(path for path in matches if path not in paths)
+    return paths
+
+
+def get_result_path(path, output=None, output_format=None):
+    '''Функция выбора пути для результата.
+    ======================================
+
+    Параметры:
+    ----------
+    path : Path
+        входной файл
+    output : str или Path
+        файл результата, каталог или None - рядом с входным файлом
+    output_format : str
+        csv, parquet или xlsx, по умолчанию как у входного файла
+        или по расширению output
+
+    Возвращаемые значения:
+    ----------------------
+    Path
+        путь вида <имя>Result.<формат> или output, если это файл
+
+    '''
+    path = Path(path)
+    if output is not None and not Path(output).is_dir() and Path(output).suffix:
+        return Path(output)
+
+    suffix = f'.{output_format}' if output_format else path.suffix
+    name = f'{path.stem}Result{suffix}'
+    return Path(output) / name if output is not None else path.with_name(name)
+
+
+def read_offers_file(path):
+    '''Функция чтения файла с предложениями.
+    ========================================
+
+    Параметры:
+    ----------
+    path : Path
+        файл в формате csv, parquet или xlsx
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        данные запроса и выдачи пользователя без столбца позиции
+
+    '''
+    file_format = _get_format(path)
+    if file_format == 'csv':
+        df = pd.read_csv(path)
+    elif file_format == 'parquet':
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_excel(path)
+    return df.drop(columns=drop_columns, errors='ignore')
+
+
+def write_result_file(df, path):
+    '''Функция записи результата.
+    =============================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preds
+    path : Path
+        файл в формате csv, parquet или xlsx
+
+    '''
+    file_format = _get_format(path)
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    if file_format == 'csv':
+        df.to_csv(path, index=False)
+    elif file_format == 'parquet':
+        df.to_parquet(path, index=False)
+    else:
+        df.to_excel(path)
+
+
+def rank_files(paths, output=None, output_format=None, model=None, queue_size=2):
+    '''Функция ранжирования файлов конвейером чтение - ранжирование - запись.
+    =========================================================================
+
+    Ошибка в одном файле записывается в лог и в результат, остальные
+    файлы продолжают обрабатываться.
+
+    Параметры:
+    ----------
+    paths : list Path
+        входные файлы, см. expand_inputs
+    output : str или Path
+        файл или каталог результатов, см. get_result_path
+    output_format : str
+        csv, parquet или xlsx, по умолчанию как у входного файла
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    queue_size : int
+        число файлов, ожидающих ранжирования и записи
+
+    Возвращаемые значения:
+    ----------------------
+    list dict
+        по файлу: input, output, rows и error (None при успехе)
+        в порядке входных файлов
+
+    '''
+    read_queue = queue.Queue(queue_size)
+    write_queue = queue.Queue(queue_size)
+    results = {}
+
+    def read():
+        for path in paths:
+            try:
+                read_queue.put((path, read_offers_file(path)))
+            except Exception as error:
+                read_queue.put((path, error))
+        read_queue.put(None)
+
+    def write():
+        while True:
+            item = write_queue.get()
+            if item is None:
+                break
+            path, path_result, df_result = item
+            try:
+                write_result_file(df_result, path_result)
+                results[path] = {'input': path, 'output': path_result, 'rows': len(df_result), 'error': None}
+                logger.info(f'Ranked {path}: {len(df_result)} rows -> {path_result}')
+            except Exception as error:
+                results[path] = {'input': path, 'output': path_result, 'rows': 0, 'error': error}
+                logger.error(f'Writing {path_result} failed: {error}')
+
+    reader = threading.Thread(target=read, name='read-files', daemon=True)
+    writer = threading.Thread(target=write, name='write-files', daemon=True)
+    reader.start()
+    writer.start()
+
+    try:
+        while True:
+            item = read_queue.get()
+            if item is None:
+                break
+            path, df = item
+            path_result = None
+            try:
+                if isinstance(df, Exception):
+                    raise df
+                path_result = get_result_path(path, output, output_format)
+                df_result = make_preds(make_preprocess(df), model)
+            except Exception as error:
+                results[path] = {'input': path, 'output': path_result, 'rows': 0, 'error': error}
+                logger.error(f'Ranking {path} failed: {error}')
+                continue
+            write_queue.put((path, path_result, df_result))
+    finally:
+        write_queue.put(None)
+        writer.join()
+
+    return [results[path] for path in paths]
@@ -0,0 +1,179 @@
+'''
+Модуль замеров стадий предпроцессинга и ранжирования.
+=====================================================
+
+Для каждой стадии записываются время, число строк на входе и выходе
+и изменение объёма данных. Замеры доступны тремя способами:
+объект PipelineStats, переданный в make_preprocess или make_preds,
+лог этого модуля на уровне DEBUG и функции, добавленные через
+add_metrics_hook. Если ничего из этого не включено, стадии
+выполняются без замеров.
+
+Функции:
+--------
+add_metrics_hook(hook)
+remove_metrics_hook(hook)
+get_stats(stats) `->` PipelineStats или None
+run_stage(stats, stage, function, data, *args, **kwargs) `->` результат function
+
+Классы:
+-------
+PipelineStats
+
+Зависимости:
+------------
+logging
+\nnumpy
+\npandas
+\ntime
+
+'''
+
+
+# Необходимые библиотеки
+import logging
+import numpy as np
+import pandas as pd
+import time
+
+
+# Переменные
+logger = logging.getLogger(__name__)
+
+metrics_hooks = []
+
+
+def add_metrics_hook(hook):
+    '''Функция подключения обработчика замеров.
+    ===========================================
+
+    Параметры:
+    ----------
+    hook : callable
+        вызывается для каждой стадии со словарём stage, seconds,
+        rows_in, rows_out, memory_delta
+
+    '''
+    metrics_hooks.append(hook)
+
+
+def remove_metrics_hook(hook):
+    '''Функция отключения обработчика замеров.'''
+    metrics_hooks.remove(hook)
+
+
+def _get_rows(data):
+    '''Число строк таблицы, массива или Pool.'''
+    if hasattr(data, 'num_row'):
+        return data.num_row()
+    if hasattr(data, '__len__'):
+        return len(data)
+    return None
+
+
+def _get_memory(data):
+    '''Объём данных в байтах без учёта содержимого строк, None для других типов.'''
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        return int(np.sum(data.memory_usage(index=True, deep=False)))
+    if isinstance(data, np.ndarray):
+        return data.nbytes
+    return None
+
+
+class PipelineStats:
+    '''Замеры стадий одного вызова.
+    ===============================
+
+    Атрибуты:
+    ---------
+    stages : list
+        словари stage, seconds, rows_in, rows_out, memory_delta
+        в порядке выполнения стадий, memory_delta - изменение объёма
+        таблицы или массива в байтах, None для других типов
+
+    '''
+
+    def __init__(self):
+        self.stages = []
+
+    @property
+    def total_seconds(self):
+        '''Суммарное время всех стадий.'''
+        return sum(record['seconds'] for record in self.stages)
+
+    def to_frame(self):
+        '''Замеры в виде таблицы, по строке на стадию.'''
+        return pd.DataFrame(self.stages, columns=['stage', 'seconds', 'rows_in', 'rows_out', 'memory_delta'])
+
+    def add(self, stage, seconds, rows_in, rows_out, memory_delta):
+        '''Запись замера стадии с передачей в лог и обработчики.'''
+        record = {
+            'stage': stage,
+            'seconds': seconds,
+            'rows_in': rows_in,
+            'rows_out': rows_out,
+            'memory_delta': memory_delta,
+        }
+        self.stages.append(record)
+        memory = f'{memory_delta:+d} B' if memory_delta is not None else 'n/a'
+        logger.debug(f'{stage}: {seconds * 1000:.1f} ms, rows {rows_in} -> {rows_out}, memory {memory}')
+        for hook in metrics_hooks:
+            hook(record)
+
+    def measure(self, stage, function, data, *args, **kwargs):
+        '''Выполнение стадии function(data, *args, **kwargs) с замером.'''
+        rows_in = _get_rows(data)
+        memory_in = _get_memory(data)
+        start = time.perf_counter()
+        result = function(data, *args, **kwargs)
+        seconds = time.perf_counter() - start
+        memory_out = _get_memory(result)
+        memory_delta = memory_out - memory_in if memory_in is not None and memory_out is not None else None
+        self.add(stage, seconds, rows_in, _get_rows(result), memory_delta)
+        return result
+
+
+def get_stats(stats=None):
+    '''Функция выбора объекта для замеров.
+    ======================================
+
+    Параметры:
+    ----------
+    stats : PipelineStats
+        объект, переданный вызывающим кодом
+
+    Возвращаемые значения:
+    ----------------------
+    PipelineStats или None
+        stats, новый объект, если подключены обработчики или лог DEBUG,
+        иначе None - замеры выключены
+
+    '''
+    if stats is None and (metrics_hooks or logger.isEnabledFor(logging.DEBUG)):
+        return PipelineStats()
+    return stats
+
+
+def run_stage(stats, stage, function, data, *args, **kwargs):
+    '''Функция выполнения стадии с замером, если он включён.
+    ========================================================
+
+    Параметры:
+    ----------
+    stats : PipelineStats или None
+        объект для записи замера, None - без замера
+    stage : str
+        название стадии
+    function : callable
+        стадия, вызывается как function(data, *args, **kwargs)
+    data : DataFrame
+        входные данные стадии
+
+    Возвращаемые значения:
+    ----------------------
+    результат function
+
+    '''
+    if stats is None:
+        return function(data, *args, **kwargs)
+    return stats.measure(stage, function, data, *args, **kwargs)
@@ -4,22 +4,51 @@
 
 Функции:
 --------
-make_preds(df, model) `->` df
+get_positions(request_ids, scores) `->` ndarray
+make_pool(X, thread_count) `->` Pool
+get_model_features(df) `->` df
+get_scores(df, model, thread_count, stats, score_cache, model_version) `->` ndarray
+record_tree_cost(model, n_rows, ntree_end, seconds)
+get_tree_limit(model, n_rows, latency_budget) `->` int
+get_truncated_scores(df, model, thread_count, stats, ntree_end, refine_k, refine_margin) `->` ndarray
+make_preds(df, model, top_k, thread_count, stats, pareto_margin, ntree_end, latency_budget, refine_k, refine_margin,
+           score_cache, model_version) `->` df
+make_features_data(features) `->` FeaturesData
+rank_arrays(features, request_ids, model, thread_count, stats) `->` ndarray
+get_pareto_agreement(df, pareto_margin, model, k) `->` dict
+get_ranking_agreement(positions, positions_other, k) `->` dict
+run_interactive()
 
 Переменные:
 -----------
-name_file_dictionary `->` путь до словаря городов и аэропортов в формате xlsx
-name_model `->` название ml модели
+numerical_features, categorical_features `->` признаки модели
+\nused_features `->` признаки в порядке обучения модели
+\ncat_feature_indices `->` индексы категориальных признаков
+\ntree_costs `->` замеры времени оценки моделей для бюджета времени
+\ntree_cost_decay `->` множитель веса прошлых замеров
+
+Модель и словари загружаются при первом обращении через resources,
+пути до них задаются переменными окружения RANKING_MODEL_PATH и
+RANKING_DICTIONARY_PATH или берутся рядом с модулем.
 
 Зависимости:
 ------------
-catboost
-\njoblib
+argparse
+\ncatboost
 \nlogging
 \nnumpy
 \npandas
 \npathlib
+\npyarrow - только для таблиц Arrow в rank_arrays
 \nsys
+\ntime
+\nweakref
+
+Запуск:
+-------
+`python ranking_module/main.py` - ввод пути до файла xlsx в консоли
+\n`python ranking_module/main.py agents/*.csv --output results/` - файлы,
+каталоги или шаблоны glob в форматах csv, parquet или xlsx
 
 Дата:
 -----
@@ -34,20 +63,23 @@ catboost
 
 
 # Необходимые библиотеки
-import catboost
-import joblib
+import argparse
 import logging
 import numpy as np
 import pandas as pd
 from pathlib import Path
 import sys
+import time
+import weakref
 ## Внутренние файлы
+from instrumentation import get_stats, run_stage
+from pareto import get_pareto_layers
 from preprocessing import make_preprocess
+from resources import resources
+from score_cache import get_model_version, get_row_keys
 
 
 # Переменные
-name_model = 'ranking_module\\ranking_model_catb_2500_cw1.5_0.84.pkl'
-
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
@@ -56,11 +88,369 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 
+numerical_features = [
+    'FwdFlightTime',
+    'BackFlightTime',
+    'FwdDepDelta',
+    'BackDepDelta',
+    'RequestDelta',
+    'SegmentCount',
+    'Amount',
+    'IsBaggage',
+    'isRefundPermitted',
+    'isExchangePermitted',
+    'isDiscount',
+    'InTravelPolicy',
+    'FlightTimeTotal',
+    'DeltaAmount',
+    'DeltaFlightTime',
+]
+
+categorical_features = [
+    'FwdFrom', 'FwdTo',
+    'BackFrom', 'BackTo',
+]
+
+used_features = numerical_features + categorical_features
+cat_feature_indices = list(range(len(numerical_features), len(used_features)))
+
+# Замеры времени оценки по id модели, обновляются при вызовах make_preds с ntree_end или бюджетом;
+# запись удаляется вместе с моделью, поэтому id не переиспользуется
+tree_costs = {}
+# Множитель веса прошлых замеров на каждый новый замер
+tree_cost_decay = 0.9
+
+
+def get_positions(request_ids, scores):
+    '''Функция определения позиций предложений внутри запросов.
+    ===========================================================
+
+    Позиции считаются за одну сортировку по запросу и убыванию оценки,
+    при равных оценках выше предложение, стоящее раньше во входных данных.
+
+    Параметры:
+    ----------
+    request_ids : ndarray
+        RequestID каждого предложения
+    scores : ndarray
+        оценка модели каждого предложения
+
+    Возвращаемые значения:
+    ----------------------
+    positions : ndarray
+        позиция предложения в своём запросе, начиная с 1
+
+    '''
+    request_codes = pd.factorize(request_ids)[0]
+    order = np.lexsort((-np.asarray(scores), request_codes))
+
+    # Начало группы запроса для каждого места в сортировке
+    sorted_codes = request_codes[order]
+    is_start = np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]
+    rank = np.arange(len(order))
+    group_start = np.maximum.accumulate(np.where(is_start, rank, 0))
+
+    positions = np.empty(len(order), dtype=np.int64)
+    positions[order] = rank - group_start + 1
+    return positions
+
+
+def make_pool(X, thread_count=-1):
+    '''Функция подготовки данных для модели.
+    ========================================
 
-# Загрузка модели
-model = joblib.load(name_model)
+    Параметры:
+    ----------
+    X : DataFrame или FeaturesData
+        признаки used_features, категориальные без пропусков
+    thread_count : int
+        число потоков, -1 - все ядра
+
+    Возвращаемые значения:
+    ----------------------
+    Pool
+        данные с заранее заданными индексами категориальных признаков
+
+    '''
+    # catboost импортируется при первом предсказании, вместе с моделью
+    from catboost import FeaturesData, Pool
+
+    # В FeaturesData категориальные признаки уже отделены от числовых
+    if isinstance(X, FeaturesData):
+        return Pool(X, thread_count=thread_count)
+    return Pool(X, cat_features=cat_feature_indices, thread_count=thread_count)
 
-def make_preds(df, model):
+
+def get_model_features(df):
+    '''Функция отбора признаков модели.
+    ===================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+
+    Возвращаемые значения:
+    ----------------------
+    X : DataFrame
+        признаки used_features, категориальные строками без пропусков
+
+    '''
+    X = df[used_features].copy()
+    # Категориальные признаки в компактном режиме модель получает строками
+    for column in categorical_features:
+        if isinstance(X[column].dtype, pd.CategoricalDtype):
+            X[column] = X[column].astype(object)
+    X.loc[:,categorical_features] = X.loc[:,categorical_features].fillna('')
+    return X
+
+
+def get_scores(df, model=None, thread_count=None, stats=None, score_cache=None, model_version=None):
+    '''Функция вычисления оценок модели.
+    ====================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    thread_count : int
+        число потоков модели, по умолчанию resources.thread_count
+    stats : PipelineStats
+        объект для замеров времени, строк и памяти по стадиям
+    score_cache : ScoreCache
+        кэш оценок, моделью оцениваются только строки, которых нет в кэше
+    model_version : hashable
+        версия модели в ключе кэша оценок, по умолчанию resources.version
+        для модели из resources и get_model_version для переданной
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        вероятность выбора каждого предложения
+
+    '''
+    if model is None:
+        # Модель и её версия из одной версии ресурсов
+        snapshot = resources.snapshot()
+        model = snapshot.model
+        if model_version is None:
+            model_version = snapshot.version
+    if thread_count is None:
+        thread_count = resources.thread_count
+
+    # Подготовка данных
+    stats = get_stats(stats)
+    X = get_model_features(df)
+
+    # Оценки из кэша
+    if score_cache is not None:
+        if model_version is None:
+            model_version = get_model_version(model)
+        keys = get_row_keys(X)
+        cached = np.array(score_cache.get_many(keys, model_version), dtype=float)
+        missing = np.flatnonzero(np.isnan(cached))
+        if not len(missing):
+            return cached
+        X = X.iloc[missing]
+
+    pool = run_stage(stats, 'make_pool', make_pool, X, thread_count)
+
+    # Предсказание
+    proba = run_stage(stats, 'predict_proba', model.predict_proba, pool, thread_count=thread_count)
+    if score_cache is None:
+        return proba[:, 1]
+
+    score_cache.put_many(keys[missing], proba[:, 1], model_version)
+    cached[missing] = proba[:, 1]
+    return cached
+
+
+def _fit_tree_cost(gram, moments, square):
+    '''Неотрицательные коэффициенты fixed, row, tree с наименьшей ошибкой.'''
+    best, best_error = None, np.inf
+    # Слагаемое на дерево есть всегда, остальные могут быть нулевыми
+    for terms in ([0, 1, 2], [0, 2], [1, 2], [2]):
+        matrix = gram[np.ix_(terms, terms)]
+        scale = np.sqrt(np.diag(matrix))
+        if not scale.all() or np.linalg.cond(matrix / np.outer(scale, scale)) > 1e8:
+            continue
+        solution = np.linalg.solve(matrix, moments[terms])
+        if (solution < 0).any() or solution[-1] == 0:
+            continue
+        coefficients = np.zeros(3)
+        coefficients[terms] = solution
+        error = square - 2 * coefficients @ moments + coefficients @ gram @ coefficients
+        if error < best_error:
+            best, best_error = coefficients, error
+    return best
+
+
+def record_tree_cost(model, n_rows, ntree_end, seconds):
+    '''Функция записи замера времени оценки для get_tree_limit.
+    ===========================================================
+
+    Время вызова приближается суммой fixed + row * n_rows + tree * n_rows * ntree_end:
+    постоянной части вызова, подготовки строки и оценки строки одним
+    деревом. Неотрицательные коэффициенты подбираются методом наименьших
+    квадратов по всем замерам, вес прошлых замеров убывает с множителем
+    tree_cost_decay на каждый новый.
+
+    Параметры:
+    ----------
+    model : CatBoostClassifier
+        обученная модель
+    n_rows : int
+        число оценённых предложений
+    ntree_end : int
+        число использованных деревьев, 0 - все деревья
+    seconds : float
+        время оценки, включая подготовку данных, без досчёта refine_k
+
+    '''
+    if n_rows == 0:
+        return
+    costs = tree_costs.get(id(model))
+    if costs is None:
+        # Модель CatBoost не хэшируется, запись удаляется при сборке модели
+        costs = tree_costs[id(model)] = {'gram': np.zeros((3, 3)), 'moments': np.zeros(3), 'square': 0.0}
+        weakref.finalize(model, tree_costs.pop, id(model), None)
+    if ntree_end == 0 or ntree_end >= model.tree_count_:
+        ntree_end = model.tree_count_
+
+    # Взвешенные суммы для нормальных уравнений
+    x = np.array([1.0, n_rows, n_rows * ntree_end])
+    costs['gram'] = tree_cost_decay * costs['gram'] + np.outer(x, x)
+    costs['moments'] = tree_cost_decay * costs['moments'] + x * seconds
+    costs['square'] = tree_cost_decay * costs['square'] + seconds ** 2
+
+    coefficients = _fit_tree_cost(costs['gram'], costs['moments'], costs['square'])
+    if coefficients is not None:
+        costs['fixed'], costs['row'], costs['tree'] = coefficients
+
+
+def get_tree_limit(model, n_rows, latency_budget):
+    '''Функция выбора числа деревьев под бюджет времени.
+    ====================================================
+
+    Время вызова оценивается по коэффициентам из record_tree_cost. Пока
+    замеров нет или бюджет покрывает время полной модели, используются
+    все деревья; замеры всех вызовов, полных и усечённых, уточняют оценку.
+
+    Параметры:
+    ----------
+    model : CatBoostClassifier
+        обученная модель
+    n_rows : int
+        число оцениваемых предложений
+    latency_budget : float
+        бюджет времени на оценку в секундах, без досчёта refine_k
+
+    Возвращаемые значения:
+    ----------------------
+    int
+        ntree_end для predict, 0 - все деревья, 1 - если бюджет
+        меньше времени подготовки данных
+
+    '''
+    costs = tree_costs.get(id(model), {})
+    if 'tree' not in costs or n_rows == 0:
+        return 0
+    tree_count = model.tree_count_
+    base_cost = costs['fixed'] + costs['row'] * n_rows
+    tree_cost = costs['tree'] * n_rows
+    if base_cost + tree_cost * tree_count <= latency_budget:
+        return 0
+
+    ntree_end = int((latency_budget - base_cost) / tree_cost)
+    if ntree_end >= tree_count:
+        return 0
+    return max(1, ntree_end)
+
+
+def get_truncated_scores(df, model=None, thread_count=None, stats=None, ntree_end=0,
+                         refine_k=None, refine_margin=0.25):
+    '''Функция вычисления оценок по первым деревьям модели.
+    =======================================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    thread_count : int
+        число потоков модели, по умолчанию resources.thread_count
+    stats : PipelineStats
+        объект для замеров времени, строк и памяти по стадиям
+    ntree_end : int
+        число первых деревьев, 0 - все деревья
+    refine_k : int
+        для предложений запроса, чья оценка не ниже оценки refine_k-го
+        предложения минус refine_margin, досчитываются остальные деревья,
+        эти предложения ставятся выше остальных; None - без уточнения,
+        иначе не меньше 1
+    refine_margin : float
+        запас до границы первых refine_k предложений в единицах RawFormulaVal
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        оценки в единицах RawFormulaVal, порядок внутри запроса
+        соответствует ранжированию
+
+    Время оценки первыми ntree_end деревьями, без досчёта, записывается
+    в record_tree_cost.
+
+    '''
+    if refine_k is not None and refine_k < 1:
+        raise ValueError(f'refine_k must be at least 1, got {refine_k}')
+    if model is None:
+        model = resources.model
+    if thread_count is None:
+        thread_count = resources.thread_count
+
+    stats = get_stats(stats)
+    start = time.perf_counter()
+    pool = run_stage(stats, 'make_pool', make_pool, get_model_features(df), thread_count)
+    scores = run_stage(
+        stats, 'predict_truncated', model.predict, pool,
+        prediction_type='RawFormulaVal', ntree_end=ntree_end, thread_count=thread_count
+    )
+    record_tree_cost(model, len(df), ntree_end, time.perf_counter() - start)
+    if refine_k is None or ntree_end == 0 or ntree_end >= model.tree_count_:
+        return scores
+
+    # Оценка refine_k-го предложения каждого запроса
+    request_codes = pd.factorize(df['RequestID'].to_numpy())[0]
+    positions = get_positions(request_codes, scores)
+    boundary_position = np.minimum(refine_k, np.bincount(request_codes))[request_codes]
+    is_boundary = positions == boundary_position
+    boundary = np.empty(request_codes.max() + 1)
+    boundary[request_codes[is_boundary]] = scores[is_boundary]
+
+    # Досчёт остальных деревьев для предложений у границы и выше
+    is_refined = scores >= boundary[request_codes] - refine_margin
+    refined_rows = np.flatnonzero(is_refined)
+    scores_rest = run_stage(
+        stats, 'predict_refine', model.predict, pool.slice(refined_rows),
+        prediction_type='RawFormulaVal', ntree_start=ntree_end, ntree_end=model.tree_count_,
+        thread_count=thread_count
+    )
+    scores[refined_rows] += scores_rest
+
+    # Уточнённые предложения выше остальных
+    if not is_refined.all():
+        shift = scores[~is_refined].max() - scores[is_refined].min() + 1.0
+        if shift > 0:
+            scores[~is_refined] -= shift
+    return scores
+
+
+def make_preds(df, model=None, top_k=None, thread_count=None, stats=None, pareto_margin=None,
+               ntree_end=None, latency_budget=None, refine_k=None, refine_margin=0.25, score_cache=None,
+               model_version=None):
     '''Функция делает ранжирование по представляемым данным.
     ========================================================
 
@@ -69,7 +459,31 @@ def make_preds(df, model):
     df : DataFrame
         данные запроса и выдачи пользователя
     model : CatBoostClassifier
-        обученная модель
+        обученная модель, по умолчанию из resources
+    top_k : int
+        вернуть только первые top_k предложений каждого запроса
+    thread_count : int
+        число потоков модели, по умолчанию resources.thread_count
+    stats : PipelineStats
+        объект для замеров времени, строк и памяти по стадиям
+    pareto_margin : int
+        оценивать моделью только фронт Парето запроса и pareto_margin
+        следующих слоёв, остальные предложения ставятся после них по
+        стоимости и времени перелёта; None - оценивать все предложения
+    ntree_end : int
+        оценивать только первыми ntree_end деревьями модели
+    latency_budget : float
+        бюджет времени на оценку в секундах, число деревьев подбирается
+        по замерам прошлых вызовов, см. get_tree_limit
+    refine_k : int
+        досчитать все деревья для предложений у границы первых refine_k,
+        см. get_truncated_scores
+    refine_margin : float
+        запас до границы первых refine_k в единицах RawFormulaVal
+    score_cache : ScoreCache
+        кэш оценок полной модели, с ntree_end и latency_budget не используется
+    model_version : hashable
+        версия модели в ключе кэша оценок, см. get_scores
 
     Возвращаемые значения:
     ----------------------
@@ -77,67 +491,199 @@ def make_preds(df, model):
         с заполненным рейтингом ранжирования Position
 
     '''
+    def score(df_scored):
+        if not len(df_scored):
+            return np.empty(0)
+        if ntree_end is None and latency_budget is None:
+            return get_scores(df_scored, model, thread_count, stats, score_cache, model_version)
+
+        model_scored = model if model is not None else resources.model
+        tree_limit = ntree_end
+        if tree_limit is None:
+            tree_limit = get_tree_limit(model_scored, len(df_scored), latency_budget)
+        return get_truncated_scores(
+            df_scored, model_scored, thread_count, stats, tree_limit, refine_k, refine_margin
+        )
+
+    if pareto_margin is None:
+        scores = score(df)
+    else:
+        layers = run_stage(get_stats(stats), 'get_pareto_layers', get_pareto_layers, df, pareto_margin + 1)
+        is_scored = layers <= pareto_margin
+
+        # Не оценённые предложения после оценённых: по стоимости, времени и порядку строк
+        order = np.lexsort((
+            np.arange(len(df)),
+            df['FlightTimeTotal'].to_numpy(dtype=float),
+            np.nan_to_num(df['Amount'].to_numpy(dtype=float), nan=np.inf),
+        ))
+        rank = np.empty(len(df))
+        rank[order] = np.arange(len(df))
+        scores = np.zeros(len(df))
+        if is_scored.any():
+            scores[is_scored] = score(df[is_scored])
+        scores[~is_scored] = scores.min() - 1.0 - rank[~is_scored]
+
+    # Определение ранжирования внутри запроса
+    df_result = df.copy(deep=False)
+    df_result['Position'] = get_positions(df['RequestID'].to_numpy(), scores)
+
+    if top_k is not None:
+        df_result = df_result[df_result['Position'] <= top_k]
+
+    return df_result
+
+
+def _get_column(features, name):
+    '''Столбец признака из словаря массивов или таблицы Arrow.'''
+    if hasattr(features, 'column_names'):
+        return features.column(name).to_numpy()
+    return np.asarray(features[name])
+
+
+def make_features_data(features):
+    '''Функция сборки признаков модели из столбцов.
+    ===============================================
 
-    numerical_features = [
-        'FwdFlightTime',
-        'BackFlightTime',
-        'FwdDepDelta',
-        'BackDepDelta',
-        'RequestDelta',
-        'SegmentCount',
-        'Amount',
-        'IsBaggage',
-        'isRefundPermitted',
-        'isExchangePermitted',
-        'isDiscount',
-        'InTravelPolicy',
-        'FlightTimeTotal',
-        'DeltaAmount',
-        'DeltaFlightTime',
-    ]
-
-    categorical_features = [
-        'FwdFrom', 'FwdTo',
-        'BackFrom', 'BackTo',
-    ]
-
-    used_features = numerical_features + categorical_features
+    Параметры:
+    ----------
+    features : dict, pyarrow.Table или FeaturesData
+        столбцы used_features: массивы numpy или столбцы Arrow;
+        FeaturesData возвращается без изменений
 
-    # Подготовка данных
-    X = df[used_features].copy()
-    X.loc[:,categorical_features] = X.loc[:,categorical_features].fillna('')
+    Возвращаемые значения:
+    ----------------------
+    FeaturesData
+        числовые признаки в одном буфере float32, затем категориальные
+        строками без пропусков, в порядке обучения модели
 
-    # Предсказание
-    proba = model.predict_proba(X)
+    '''
+    from catboost import FeaturesData
 
-    # Постпроцессинг, определение ранжирования
-    df_rating = df[['ID', 'RequestID']].copy()
-    df_rating['SentOption'] = pd.Series(proba[:,1], index=df.index)
+    if isinstance(features, FeaturesData):
+        return features
 
-    df_rating = df_rating.reset_index() \
-        .sort_values(by=['RequestID', 'SentOption'], ascending=False) \
-        .copy()
+    n_rows = features.num_rows if hasattr(features, 'num_rows') else len(features[used_features[0]])
+    num_feature_data = np.empty((n_rows, len(numerical_features)), dtype=np.float32)
+    for i, name in enumerate(numerical_features):
+        num_feature_data[:, i] = _get_column(features, name)
 
-    df_rating['Position'] = pd.Series(np.arange(1,len(df_rating)+1), df_rating.index)
+    cat_feature_data = np.empty((n_rows, len(categorical_features)), dtype=object)
+    for i, name in enumerate(categorical_features):
+        column = _get_column(features, name)
+        cat_feature_data[:, i] = column
+        cat_feature_data[pd.isna(column), i] = ''
 
-    df_rating = df_rating.set_index('RequestID')
-    df_rating['Start'] = df_rating.groupby(level=0)['Position'].min()
-    df_rating['Position'] -= df_rating['Start']
+    return FeaturesData(
+        num_feature_data=num_feature_data,
+        cat_feature_data=cat_feature_data,
+        num_feature_names=numerical_features,
+        cat_feature_names=categorical_features,
+    )
 
-    position = df_rating.set_index('index') \
-        .drop(columns=['SentOption', 'Start']) \
-        .sort_index() \
-        .reset_index(drop=True)
-    position += 1
 
-    # Добавление в результат
-    df_result = df.copy()
-    df_result['Position'] = position['Position']
+def rank_arrays(features, request_ids, model=None, thread_count=None, stats=None):
+    '''Функция ранжирования предложений по столбцам признаков.
+    ==========================================================
 
-    return df_result.copy()
+    В отличие от make_preds не строит промежуточных таблиц: столбцы
+    копируются один раз в буферы FeaturesData, результат - только позиции.
 
+    Параметры:
+    ----------
+    features : dict, pyarrow.Table или FeaturesData
+        столбцы used_features результата make_preprocess, см. make_features_data
+    request_ids : ndarray или столбец Arrow
+        RequestID каждого предложения
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    thread_count : int
+        число потоков модели, по умолчанию resources.thread_count
+    stats : PipelineStats
+        объект для замеров времени, строк и памяти по стадиям
 
-if __name__ == "__main__":
+    Возвращаемые значения:
+    ----------------------
+    positions : ndarray
+        позиция предложения в своём запросе, начиная с 1
+
+    '''
+    if model is None:
+        model = resources.model
+    if thread_count is None:
+        thread_count = resources.thread_count
+    if hasattr(request_ids, 'to_numpy'):
+        request_ids = request_ids.to_numpy()
+
+    stats = get_stats(stats)
+    pool = run_stage(stats, 'make_pool', make_pool, make_features_data(features), thread_count)
+    proba = run_stage(stats, 'predict_proba', model.predict_proba, pool, thread_count=thread_count)
+    return get_positions(np.asarray(request_ids), proba[:, 1])
+
+
+def get_pareto_agreement(df, pareto_margin=0, model=None, k=3):
+    '''Функция сравнения ранжирования с фильтром Парето и полной моделью.
+    =====================================================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+    pareto_margin : int
+        число слоёв после фронта, см. make_preds
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    k : int
+        число первых позиций для сравнения
+
+    Возвращаемые значения:
+    ----------------------
+    dict
+        scored_share - доля предложений, оценённых моделью,
+        и сравнение с полной моделью из get_ranking_agreement
+
+    '''
+    positions = make_preds(df, model)['Position'].to_numpy()
+    positions_pareto = make_preds(df, model, pareto_margin=pareto_margin)['Position'].to_numpy()
+    is_scored = get_pareto_layers(df, pareto_margin + 1) <= pareto_margin
+
+    return {'scored_share': float(is_scored.mean()), **get_ranking_agreement(positions, positions_pareto, k)}
+
+
+def get_ranking_agreement(positions, positions_other, k=3):
+    '''Функция сравнения двух ранжирований.
+    =======================================
+
+    Параметры:
+    ----------
+    positions : ndarray
+        позиции эталонного ранжирования
+    positions_other : ndarray
+        позиции сравниваемого ранжирования тех же предложений
+    k : int
+        число первых позиций для сравнения
+
+    Возвращаемые значения:
+    ----------------------
+    dict
+        position_agreement - доля предложений с той же позицией,
+        \ntop1_agreement - доля запросов с тем же первым предложением,
+        \ntop_k_recall - доля первых k эталонных предложений,
+        попавших в первые k сравниваемого ранжирования
+
+    '''
+    is_top1 = positions == 1
+    is_top_k = positions <= k
+    return {
+        'position_agreement': float((positions == positions_other).mean()),
+        'top1_agreement': float((positions_other[is_top1] == 1).mean()),
+        'top_k_recall': float((positions_other[is_top_k] <= k).mean()),
+    }
+
+
+def run_interactive():
+    '''Ранжирование файлов xlsx с вводом пути в консоли.'''
+    resources.warm_up()
     while True:
         # Загрузка файла
         file_request = input("Введите путь/название файла в формате xlsx: ")
@@ -148,7 +694,7 @@ if __name__ == "__main__":
         processed_df = make_preprocess(df_agent)
         logger.info(f'Number of features: {processed_df.shape[1]}')
 
-        df_result = make_preds(processed_df, model)
+        df_result = make_preds(processed_df)
 
         # Выгрузка файла
         name_file = Path(file_request).stem
@@ -156,3 +702,31 @@ if __name__ == "__main__":
         df_result.to_excel(result_path_file)
         logger.info(f'Predictions done: {df_result}')
         print(f'Работа выполнена, ваш файл: {result_path_file}')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description='Ранжирование предложений из файлов csv, parquet или xlsx, без аргументов - ввод пути в консоли'
+    )
+    parser.add_argument('inputs', nargs='*', help='файлы, каталоги или шаблоны glob')
+    parser.add_argument('-o', '--output', default=None, help='файл или каталог результатов, по умолчанию рядом с входными')
+    parser.add_argument('--format', choices=['csv', 'parquet', 'xlsx'], default=None,
+                        help='формат результата, по умолчанию как у входного файла')
+    parser.add_argument('--queue-size', type=int, default=2, help='число файлов в очередях чтения и записи')
+    args = parser.parse_args()
+
+    if not args.inputs:
+        run_interactive()
+    else:
+        from files import expand_inputs, rank_files
+
+        logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        paths = expand_inputs(args.inputs)
+        if args.output is not None and len(paths) > 1 and Path(args.output).suffix:
+            parser.error('для нескольких входных файлов --output должен быть каталогом')
+
+        resources.warm_up()
+        results = rank_files(paths, args.output, args.format, queue_size=args.queue_size)
+        failed = [result for result in results if result['error'] is not None]
+        print(f'Работа выполнена, файлов: {len(results) - len(failed)}, с ошибкой: {len(failed)}')
+        sys.exit(1 if failed or not results else 0)
@@ -0,0 +1,158 @@
+'''
+Модуль поиска недоминируемых предложений.
+=========================================
+
+Предложение доминируется, если в том же запросе есть другое не дороже
+(Amount), не дольше (FlightTimeTotal), с не худшими флагами багажа,
+возврата, обмена и тревел-политики и хотя бы в чём-то лучше. Пропуски
+во флагах считаются 0, пропуск стоимости - худшим значением.
+
+Для каждой из 16 комбинаций флагов считается накопленный минимум
+времени перелёта по предложениям, отсортированным по запросу
+и стоимости, поэтому поиск фронта векторизован и работает за
+O(n log n) на всю пачку.
+
+Функции:
+--------
+get_flag_masks(df) `->` ndarray
+get_dominated(request_codes, amount, flight_time, flag_masks) `->` ndarray
+get_pareto_layers(df, n_layers) `->` ndarray
+
+Переменные:
+-----------
+pareto_flags `->` флаги, большее значение которых лучше
+
+Зависимости:
+------------
+numpy
+\npandas
+
+'''
+
+
+# Необходимые библиотеки
+import numpy as np
+import pandas as pd
+
+
+# Переменные
+pareto_flags = ['IsBaggage', 'isRefundPermitted', 'isExchangePermitted', 'InTravelPolicy']
+
+
+def get_flag_masks(df):
+    '''Функция кодирования флагов предложения битовой маской.
+    =========================================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        маска от 0 до 15, бит i - флаг pareto_flags[i] больше 0
+
+    '''
+    flag_masks = np.zeros(len(df), dtype=np.int64)
+    for bit, column in enumerate(pareto_flags):
+        flag_masks |= (np.nan_to_num(df[column].to_numpy(dtype=float)) > 0).astype(np.int64) << bit
+    return flag_masks
+
+
+def get_dominated(request_codes, amount, flight_time, flag_masks):
+    '''Функция поиска доминируемых предложений.
+    ===========================================
+
+    Параметры:
+    ----------
+    request_codes : ndarray
+        код запроса каждого предложения
+    amount : ndarray
+        стоимость, меньше - лучше
+    flight_time : ndarray
+        время перелёта, меньше - лучше
+    flag_masks : ndarray
+        маски флагов из get_flag_masks, больше флагов - лучше
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        True для предложений, доминируемых другим предложением того же запроса
+
+    '''
+    n = len(amount)
+    amount = np.where(np.isnan(amount), np.inf, amount)
+    flight_time = np.asarray(flight_time, dtype=float)
+
+    # Сортировка по запросу, стоимости и времени
+    order = np.lexsort((flight_time, amount, request_codes))
+    codes, amount, flight_time, masks = request_codes[order], amount[order], flight_time[order], flag_masks[order]
+
+    # Блоки предложений запроса с одинаковой стоимостью
+    is_block_start = np.r_[True, (codes[1:] != codes[:-1]) | (amount[1:] != amount[:-1])]
+    block = np.cumsum(is_block_start) - 1
+    block_start = np.flatnonzero(is_block_start)
+    block_end = np.r_[block_start[1:], n] - 1
+    has_previous_block = np.r_[False, codes[block_start[1:]] == codes[block_start[:-1]]]
+
+    dominated = np.zeros(n, dtype=bool)
+    for mask in np.unique(masks):
+        is_mask = masks == mask
+        masked_time = np.where(is_mask, flight_time, np.inf)
+        cummin = pd.Series(masked_time).groupby(codes).cummin().to_numpy()
+
+        # Лучшее время среди предложений не дороже, включая весь блок
+        upto_block = cummin[block_end]
+        # Лучшее время среди строго более дешёвых
+        before_block = np.where(has_previous_block, np.r_[np.inf, upto_block[:-1]], np.inf)
+        # Лучшее время в блоке той же стоимости
+        block_min = np.minimum.reduceat(masked_time, block_start)
+
+        # Флаги mask строго лучше: достаточно не хуже по стоимости и времени
+        is_subset = ((masks & mask) == masks) & (masks != mask)
+        dominated |= is_subset & (upto_block[block] <= flight_time)
+        # Те же флаги: нужно строгое улучшение стоимости или времени
+        dominated |= is_mask & ((before_block[block] <= flight_time) | (block_min[block] < flight_time))
+
+    result = np.empty(n, dtype=bool)
+    result[order] = dominated
+    return result
+
+
+def get_pareto_layers(df, n_layers=1):
+    '''Функция разбиения предложений на слои Парето.
+    ================================================
+
+    Слой 0 - недоминируемые предложения запроса, слой 1 - недоминируемые
+    после удаления слоя 0 и так далее.
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+    n_layers : int
+        число выделяемых слоёв
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        номер слоя каждого предложения, n_layers для предложений глубже
+
+    '''
+    request_codes = pd.factorize(df['RequestID'].to_numpy())[0]
+    amount = df['Amount'].to_numpy(dtype=float)
+    flight_time = df['FlightTimeTotal'].to_numpy(dtype=float)
+    flag_masks = get_flag_masks(df)
+
+    layers = np.full(len(df), n_layers, dtype=np.int64)
+    remaining = np.arange(len(df))
+    for layer in range(n_layers):
+        if not len(remaining):
+            break
+        dominated = get_dominated(
+            request_codes[remaining], amount[remaining], flight_time[remaining], flag_masks[remaining]
+        )
+        layers[remaining[~dominated]] = layer
+        remaining = remaining[dominated]
+    return layers
@@ -4,20 +4,38 @@
 
 Функции:
 --------
-convert_number_to_hour(number) `->` datatime
-get_fwd_flight_time(df) `->` df
-get_back_fligh_time(df) `->` df
+get_time_zone(codes, time_zone_dictionary) `->` ndarray
+convert_number_to_timedelta(number) `->` ndarray
+get_flight_time(departure_date, arrival_date, time_zone_from, time_zone_to) `->` ndarray
+parse_routes(routes) `->` Routes
+get_leg_flight_time(routes, leg, departure_date, arrival_date, time_zone_dictionary) `->` ndarray
+get_fwd_flight_time(df, time_zone_dictionary, routes) `->` df
+get_back_fligh_time(df, time_zone_dictionary, routes) `->` df
+is_time_specified(dates) `->` Series
+normalize_datetimes(df) `->` df
 get_difference_request_time(df) `->` df
-def make_preprocess(df) `->` df
+get_days_before_departure(df) `->` df
+get_request_deltas(df) `->` df
+make_compact(df) `->` df
+make_preprocess(df, stats, compact, time_zone_dictionary) `->` df
 
-Переменные:
------------
-ndf_dictionary_city
-\ndf_dictionary_airport
+Классы:
+-------
+InvalidOffersError
+
+SearchRoute разбирается один раз на уникальный маршрут: участки
+через '/', в каждом три буквы пункта вылета и код пункта прилёта.
+
+Справочник часовых поясов загружается при первом вызове make_preprocess
+из общего реестра resources. Замеры стадий make_preprocess описаны
+в модуле instrumentation.
 
 Зависимости:
 ------------
-pandas
+collections
+\nfunctools
+\nnumpy
+\npandas
 
 Дата:
 -----
@@ -32,38 +50,214 @@ pandas
 
 
 # Необходимые библиотеки
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+## Внутренние файлы
+from instrumentation import get_stats, run_stage
+from resources import resources
+
+
+# Переменные
+datetime_features = [
+    'RequestDate',
+    'RequestDepartureDate',
+    'RequestReturnDate',
+    'DepartureDate',
+    'ArrivalDate',
+    'ReturnDepatrureDate',
+    'ReturnArrivalDate'
+]
+datetime_format = 'ISO8601'
+time_specified_columns = ['RequestDepartureTimeSpecified', 'RequestReturnTimeSpecified']
+# Число разобранных маршрутов, которые хранятся между вызовами
+route_cache_size = 65536
+compact_categorical_columns = ['FwdFrom', 'FwdTo', 'BackFrom', 'BackTo', 'SearchRoute', 'class', 'FligtOption']
+compact_flag_columns = ['IsBaggage', 'isRefundPermitted', 'isExchangePermitted', 'isDiscount', 'InTravelPolicy']
+compact_numerical_columns = [
+    'SegmentCount', 'FwdFlightTime', 'BackFlightTime', 'FwdDepDelta', 'BackDepDelta', 'RequestDelta',
+    'FlightTimeTotal', 'DeltaFlightTime', 'Amount', 'DeltaAmount'
+]
+
+# Разобранные маршруты: массивы (строки, участки) пунктов вылета и прилёта,
+# NaN для отсутствующих участков, и число участков каждой строки
+Routes = namedtuple('Routes', ['origins', 'destinations', 'leg_count'])
+
+
+class InvalidOffersError(ValueError):
+    '''Входные предложения не удалось обработать: неверные даты, маршруты или типы столбцов.'''
+
+
+def get_time_zone(codes, time_zone_dictionary):
+    '''Функция получения часовых поясов по IATA кодам.
+    ==================================================
 
+    Параметры:
+    ----------
+    codes : Series
+        IATA коды городов или аэропортов
+    time_zone_dictionary : Series
+        справочник из make_time_zone_dictionary
 
-# Загрузка словарей
-name_file_dictionary = 'ranking_module\\Locations_UTC.xlsx'
-xl = pd.ExcelFile(name_file_dictionary)
-df_dictionary_city = xl.parse('City')
-df_dictionary_airport = xl.parse('Airport')
-xl.close()
+    Возвращаемые значения:
+    ----------------------
+    time_zone : ndarray
+        часовые пояса, 0 для ненайденных кодов
 
+    '''
+    position = time_zone_dictionary.index.get_indexer(codes)
+    time_zone = time_zone_dictionary.to_numpy(dtype=float)[position]
+    time_zone[position < 0] = 0.0
+    return time_zone
 
-def convert_number_to_hour(number):
-    '''Функция конвертации числа в часы.
-    ====================================
+
+def convert_number_to_timedelta(number):
+    '''Функция конвертации чисел в часы и минуты.
+    ============================================
+
+    Целая часть числа - часы, два знака после запятой - минуты.
+
+    Параметры:
+    ----------
+    number : array_like
+        числа, обозначающие время, со знаком
+
+    Возращаемые значения:
+    ---------------------
+    ndarray
+        время в формате timedelta64[ns] с тем же знаком
+
+    '''
+    number = np.asarray(number, dtype=float)
+    hour, minute = np.divmod(np.round(np.abs(number) * 100), 100)
+    minutes = np.copysign(hour * 60 + minute, number).astype(np.int64)
+    return minutes.astype('<m8[m]').astype('<m8[ns]')
+
+
+def get_flight_time(departure_date, arrival_date, time_zone_from, time_zone_to):
+    '''Функция вычисления времени перелёта в минутах.
+    ==================================================
 
     Параметры:
     ----------
-    number : float
-        число, обозначащее время
+    departure_date : Series
+        местное время вылета
+    arrival_date : Series
+        местное время прилёта
+    time_zone_from : ndarray
+        часовой пояс пункта вылета
+    time_zone_to : ndarray
+        часовой пояс пункта прилёта
 
     Возращаемые значения:
     ---------------------
-    datetime
-        время в часах и минутах
+    ndarray
+        время перелёта в минутах
+
+    '''
+    difference_date = arrival_date.astype("datetime64[ns]").to_numpy() \
+        - departure_date.astype("datetime64[ns]").to_numpy()
+    difference_zone = convert_number_to_timedelta(time_zone_from - time_zone_to)
+    return (difference_date + difference_zone).astype('<m8[m]').astype(int)
+
+
+@lru_cache(maxsize=route_cache_size)
+def _parse_route(route):
+    '''Пункты вылета и прилёта участков маршрута, участки - части route.split('/').'''
+    legs = route.split('/')
+    return tuple(leg[0:3] for leg in legs), tuple(leg[3:] for leg in legs)
+
+
+def parse_routes(routes):
+    '''Функция разбора маршрутов поиска.
+    ====================================
+
+    Каждый уникальный маршрут разбирается один раз, результаты хранятся
+    между вызовами для route_cache_size последних маршрутов. Участок leg
+    совпадает с SearchRoute.str.split('/').str.get(leg): пункт вылета -
+    первые три символа, пункт прилёта - остальные.
+
+    Параметры:
+    ----------
+    routes : Series или ndarray
+        SearchRoute: участки через '/', например ALAMOW или MOWLED/LEDMOW
+
+    Возвращаемые значения:
+    ----------------------
+    Routes
+        origins, destinations - массивы (строки, участки), не меньше двух
+        участков, NaN для отсутствующих; leg_count - число участков,
+        0 для пропущенного маршрута
+
+    '''
+    codes, unique_routes = pd.factorize(np.asarray(routes, dtype=object))
+    parsed = [_parse_route(str(route)) for route in unique_routes]
+    n_legs = max([2] + [len(origins) for origins, _ in parsed])
+
+    # Последняя строка - для пропущенных маршрутов с кодом -1
+    origins = np.full((len(parsed) + 1, n_legs), np.nan, dtype=object)
+    destinations = np.full((len(parsed) + 1, n_legs), np.nan, dtype=object)
+    leg_count = np.zeros(len(parsed) + 1, dtype=np.int64)
+    for position, (route_origins, route_destinations) in enumerate(parsed):
+        origins[position, :len(route_origins)] = route_origins
+        destinations[position, :len(route_destinations)] = route_destinations
+        leg_count[position] = len(route_origins)
+
+    return Routes(origins[codes], destinations[codes], leg_count[codes])
+
+
+def get_leg_flight_time(routes, leg, departure_date, arrival_date, time_zone_dictionary=None):
+    '''Функция вычисления времени перелёта участка маршрута.
+    =======================================================
+
+    Параметры:
+    ----------
+    routes : Routes
+        результат parse_routes
+    leg : int
+        номер участка, с 0
+    departure_date : Series
+        местное время вылета на участке
+    arrival_date : Series
+        местное время прилёта на участке
+    time_zone_dictionary : Series
+        справочник часовых поясов, по умолчанию из resources
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        время перелёта в минутах, NaN без дат или без участка; первый
+        участок считается и без маршрута с нулевыми часовыми поясами
 
     '''
-    hour = ('%.2f' % number).split(sep='.')[0]
-    minute = ('%.2f' % number).split(sep='.')[1]
-    return pd.to_datetime(hour+":"+minute, format='%H:%M')
+    if time_zone_dictionary is None:
+        time_zone_dictionary = resources.time_zone_dictionary
+
+    origins = routes.origins[:, leg]
+    destinations = routes.destinations[:, leg]
+    has_dates = (departure_date.notna() & arrival_date.notna()).to_numpy()
+    if leg > 0:
+        has_dates &= pd.notna(origins)
+
+    flight_time = np.full(len(origins), np.nan)
+    flight_time[has_dates] = get_flight_time(
+        departure_date[has_dates],
+        arrival_date[has_dates],
+        get_time_zone(origins[has_dates], time_zone_dictionary),
+        get_time_zone(destinations[has_dates], time_zone_dictionary)
+    )
+    return flight_time
+
+
+def _to_int_if_complete(values):
+    '''Время в минутах как int, если пропусков нет.'''
+    if np.isnan(values).any():
+        return values
+    return values.astype(int)
 
 
-def get_fwd_flight_time(df, all_columns):
+def get_fwd_flight_time(df, time_zone_dictionary=None, routes=None):
     '''Функция для вычисления времени полёта туда.
     ==============================================
 
@@ -71,141 +265,34 @@ def get_fwd_flight_time(df, all_columns):
     ----------
     df : DataFrame
         данные запроса и выдачи пользователя
-    all_columns : list
-        список с названиями всех столбцов
+    time_zone_dictionary : Series
+        справочник часовых поясов, по умолчанию из resources
+    routes : Routes
+        разобранный SearchRoute, по умолчанию разбирается parse_routes
 
     Возвращаемые значения:
     ----------------------
     df : DataFrame
-        с новыми полями FwdFlightTime, FwdFrom, FwdTo
+        тот же df с новыми полями FwdFlightTime, FwdFrom, FwdTo,
+        FwdFlightTime пустое для предложений без дат перелёта
 
     '''
-    # Выделение путей следования
-    df['FwdFrom'] = df['SearchRoute'].str.split('/').str[0].str[0:3]
-    df['FwdTo'] = df['SearchRoute'].str.split('/').str[0].str[3:]
-
-    # Получение часовой зоны пути туда
-    df = df.merge(
-        df_dictionary_city[['IataCode','TimeZone']], 
-        left_on='FwdFrom',
-        right_on='IataCode',
-        how='left',
-        indicator=True
-    )
-    df.rename(columns={'TimeZone': 'TimeZoneFwdFrom'}, inplace=True)
-    df.drop(['IataCode', '_merge'], axis=1, inplace=True)
-
-
-    # Поиск часовой зоны по аэропортам
-    df_for_airoport = df[~(df['TimeZoneFwdFrom'].notna())].copy()
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_airport[['IATACode','CityID']],
-        left_on='FwdFrom', 
-        right_on='IATACode',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop('_merge', axis=1, inplace=True)
-    df_for_airoport_all = df_for_airoport.merge(
-        df_dictionary_city[['Id','TimeZone']],
-        left_on='CityID',
-        right_on='Id',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport_all.drop(
-        ['TimeZoneFwdFrom', 'IATACode', 'CityID', 'Id', '_merge'],
-        axis=1,
-        inplace=True
-    )
-    df_for_airoport_all.rename(columns={'TimeZone': 'TimeZoneFwdFrom'}, inplace=True)
-
-    # Объединение часовых зон из справочников аэропортов и городов
-    column_for_merge = all_columns + ['FwdFrom', 'FwdTo']
-    df = df.merge(
-        df_for_airoport_all,
-        left_on=column_for_merge,
-        right_on=column_for_merge,
-        how="left",
-        indicator='exists'
-    )
-    df['TimeZoneFwdFrom'] = df['TimeZoneFwdFrom_x'].fillna(0) + df['TimeZoneFwdFrom_y'].fillna(0)
-    df.drop(['TimeZoneFwdFrom_x', 'TimeZoneFwdFrom_y', 'exists'], axis=1, inplace=True)
-    
-    # Часовой пояс туда
-    df = df.merge(
-        df_dictionary_city[['IataCode','TimeZone']], 
-        left_on='FwdTo',
-        right_on='IataCode',
-        how='left',
-        indicator=True
-    )
-    df.rename(columns={'TimeZone': 'TimeZoneFwdTo'}, inplace=True)
-    df.drop(['IataCode', '_merge'], axis=1, inplace=True)
-
-    # Поиск часовой зоны по аэропортам
-    df_for_airoport = df[~(df['TimeZoneFwdTo'].notna())]
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_airport[['IATACode','CityID']],
-        left_on='FwdTo', 
-        right_on='IATACode',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop('_merge', axis=1, inplace=True)
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_city[['Id','TimeZone']],
-        left_on='CityID',
-        right_on='Id',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop(['TimeZoneFwdTo', 'IATACode', 'CityID', 'Id', '_merge'], axis=1, inplace=True)
-    df_for_airoport.rename(columns={'TimeZone': 'TimeZoneFwdTo'}, inplace=True)
-    
-    # Объединение данных из справочника аэропортов и городов
-    column_for_merge += ['TimeZoneFwdFrom']
-    df = df.merge(
-        df_for_airoport,
-        left_on=column_for_merge,
-        right_on=column_for_merge,
-        how="left"
-    )
-    df['TimeZoneFwdTo'] = df['TimeZoneFwdTo_x'].fillna(0) + df['TimeZoneFwdTo_y'].fillna(0)
-    df.drop(['TimeZoneFwdTo_x', 'TimeZoneFwdTo_y'], axis=1, inplace=True)
-
-    # Разница во времени и часовых поясах
-    df['DifferenceDate'] = df[
-        'ArrivalDate'].astype("datetime64[ns]") - df['DepartureDate'].astype("datetime64[ns]")
-    df['DifferenceZone'] = df.apply(lambda x: x['TimeZoneFwdFrom'] - x['TimeZoneFwdTo'], axis=1)
-    df.loc[df['DifferenceZone'] < 0, 'DifferenceZoneSymbol'] = '-'
-    df.loc[df['DifferenceZone'] >= 0, 'DifferenceZoneSymbol'] = '+'
-    df = df[df['DifferenceDate'].notna()]
-    df['DifferenceZone'] = df['DifferenceZone'].abs().apply(convert_number_to_hour).dt.strftime('%H:%M:%S')
-    
-    # Вычисление времени перелёта
-    df.loc[df['DifferenceZoneSymbol'] == '-', 'FwdFlightTime'] =df.apply(
-        lambda x: x['DifferenceDate'] - x['DifferenceZone'], axis=1
-    )
-    df.loc[df['DifferenceZoneSymbol'] == '+', 'FwdFlightTime'] = df.apply(
-        lambda x: x['DifferenceDate'] + x['DifferenceZone'], axis=1
-    )
+    if routes is None:
+        routes = parse_routes(df['SearchRoute'])
 
-    # Удаление лишних столбцов
-    df.drop(
-        ['TimeZoneFwdFrom', 'TimeZoneFwdTo', 'DifferenceDate', 'DifferenceZone', 'DifferenceZoneSymbol'],
-        axis=1,
-        inplace=True
-    )
-    
-    # Время полёта
-    df['FwdFlightTime'] = df['FwdFlightTime'].values.astype('<m8[m]').astype(int)
-    df = df.drop_duplicates()
+    # Пути следования первого участка
+    df['FwdFrom'] = routes.origins[:, 0]
+    df['FwdTo'] = routes.destinations[:, 0]
 
+    # Время полёта с учётом часовых поясов
+    flight_time = get_leg_flight_time(
+        routes, 0, df['DepartureDate'], df['ArrivalDate'], time_zone_dictionary
+    )
+    df['FwdFlightTime'] = _to_int_if_complete(flight_time)
     return df
 
 
-def get_back_fligh_time(df, all_columns):
+def get_back_fligh_time(df, time_zone_dictionary=None, routes=None):
     '''Функция для вычисления времени полёта обратно.
     =================================================
 
@@ -213,145 +300,92 @@ def get_back_fligh_time(df, all_columns):
     ----------
     df : DataFrame
         данные запроса и выдачи пользователя
-    all_columns : list
-        список с названиями всех столбцов
+    time_zone_dictionary : Series
+        справочник часовых поясов, по умолчанию из resources
+    routes : Routes
+        разобранный SearchRoute, по умолчанию разбирается parse_routes
 
     Возвращаемые значения:
     ----------------------
     df : DataFrame
-        с новым полем BackFlightTime, BackTo, BackFrom
+        тот же df с новыми полями BackFlightTime, BackTo, BackFrom,
+        BackFlightTime пустое для перелётов в одну сторону и предложений без дат
 
     '''
-    # Выделение путей следования
-    df['BackFrom'] = df['SearchRoute'].str.split('/').str[1].str[0:3]
-    df['BackTo'] = df['SearchRoute'].str.split('/').str[1].str[3:]
-
-    # Отсекаем пустые значения
-    df = df[df['BackFrom'].notna()]
-    df = df[df['ReturnDepatrureDate'].notna()]
-
-    # Часовой пояс туда
-    df = df.merge(
-        df_dictionary_city[['IataCode','TimeZone']],
-        left_on='BackFrom',
-        right_on='IataCode',
-        how='left',
-        indicator=True
-    )
-    df.rename(columns={'TimeZone': 'TimeZoneBackFrom'}, inplace=True)
-    df.drop(['IataCode', '_merge'], axis=1, inplace=True)
-
-    # Поиск часовой зоны по аэропортам
-    df_for_airoport = df[~(df['TimeZoneBackFrom'].notna())]
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_airport[['IATACode','CityID']],
-        left_on='BackFrom',
-        right_on='IATACode',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop('_merge', axis=1, inplace=True)
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_city[['Id','TimeZone']],
-        left_on='CityID',
-        right_on='Id',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop(['TimeZoneBackFrom', 'IATACode', 'CityID', 'Id', '_merge'], axis=1, inplace=True)
-    df_for_airoport.rename(columns={'TimeZone': 'TimeZoneBackFrom'}, inplace=True)
-
-    # Объединение данных из справочника аэропортов и городов
-    column_for_merge = all_columns + ['FwdTo', 'FwdFrom', 'BackFrom', 'BackTo', 'FwdFlightTime']
-    df = df.merge(
-        df_for_airoport,
-        left_on=column_for_merge,
-        right_on=column_for_merge,
-        how="left"
-    )
-    df['TimeZoneBackFrom'] = df['TimeZoneBackFrom_x'].fillna(0) + df['TimeZoneBackFrom_y'].fillna(0)
-    df.drop(['TimeZoneBackFrom_x', 'TimeZoneBackFrom_y'], axis=1, inplace=True)
-
-    # Часовой пояс обратно
-    df = df.merge(
-        df_dictionary_city[['IataCode','TimeZone']],
-        left_on='BackTo',
-        right_on='IataCode',
-        how='left',
-        indicator=True
-    )
-    df.rename(columns={'TimeZone': 'TimeZoneBackTo'}, inplace=True)
-    df.drop(['IataCode', '_merge'], axis=1, inplace=True)
-
-    # Поиск часовой зоны по аэропортам
-    df_for_airoport = df[~(df['TimeZoneBackTo'].notna())]
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_airport[['IATACode','CityID']],
-        left_on='BackTo',
-        right_on='IATACode',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop('_merge', axis=1, inplace=True)
-    df_for_airoport = df_for_airoport.merge(
-        df_dictionary_city[['Id','TimeZone']],
-        left_on='CityID',
-        right_on='Id',
-        how='left',
-        indicator=True
-    )
-    df_for_airoport.drop(['TimeZoneBackTo', 'IATACode', 'CityID', 'Id', '_merge'], axis=1, inplace=True)
-    df_for_airoport.rename(columns={'TimeZone': 'TimeZoneBackTo'}, inplace=True)
-
-    # Объединение данных из справочника аэропортов и городов
-    column_for_merge += ['TimeZoneBackTo']
-    df = df.merge(
-        df_for_airoport,
-        left_on=column_for_merge,
-        right_on=column_for_merge,
-        how="left"
-    )
-    df['TimeZoneBackFrom'] = df['TimeZoneBackFrom_x'].fillna(0) + df['TimeZoneBackFrom_y'].fillna(0)
-    df.drop(['TimeZoneBackFrom_x', 'TimeZoneBackFrom_y'], axis=1, inplace=True)
-
-    # Разница во времени и часовых поясах
-    df['DifferenceDate'] = df['ReturnArrivalDate'].astype(
-        "datetime64[ns]") - df['ReturnDepatrureDate'].astype("datetime64[ns]")
-    df['DifferenceZone'] = df.apply(lambda x: x['TimeZoneBackFrom'] - x['TimeZoneBackTo'], axis=1)
-    df.loc[df['DifferenceZone'] < 0, 'DifferenceZoneSymbol'] = '-'
-    df.loc[df['DifferenceZone'] >= 0, 'DifferenceZoneSymbol'] = '+'
-    df['DifferenceZone'] = df['DifferenceZone'].abs().apply(convert_number_to_hour).dt.strftime('%H:%M:%S')
-
-    # Вычисление времени перелёта
-    df.loc[df['DifferenceZoneSymbol'] == '-', 'BackFlightTime'] = df.apply(
-        lambda x: x['DifferenceDate'] - x['DifferenceZone'], axis=1)
-    df.loc[df['DifferenceZoneSymbol'] == '+', 'BackFlightTime'] = df.apply(
-        lambda x: x['DifferenceDate'] + x['DifferenceZone'], axis=1)
-    
-    # Удаление лишних столбцов
-    df.drop(
-        [
-            'TimeZoneBackFrom',
-            'TimeZoneBackTo',
-            'DifferenceDate',
-            'DifferenceZone',
-            'DifferenceZoneSymbol'
-        ],
-        axis=1,
-        inplace=True
+    if routes is None:
+        routes = parse_routes(df['SearchRoute'])
+
+    # Пути следования второго участка
+    df['BackFrom'] = routes.origins[:, 1]
+    df['BackTo'] = routes.destinations[:, 1]
+
+    # Время полёта с учётом часовых поясов
+    flight_time = get_leg_flight_time(
+        routes, 1, df['ReturnDepatrureDate'], df['ReturnArrivalDate'], time_zone_dictionary
     )
+    df['BackFlightTime'] = _to_int_if_complete(flight_time)
+    return df
+
+
+def is_time_specified(dates):
+    '''Функция определения, указано ли время в дате запроса.
+    ========================================================
+
+    Параметры:
+    ----------
+    dates : Series
+        даты в формате datetime64
+
+    Возвращаемые значения:
+    ----------------------
+    Series
+        True, если время отлично от 00:00, False для полуночи и пропусков
+
+    '''
+    return dates.notna() & (dates != dates.dt.normalize())
+
+
+def normalize_datetimes(df):
+    '''Функция однократного разбора дат.
+    ======================================
+
+    Поля datetime_features переводятся в datetime64 по формату ISO8601,
+    уже разобранные поля не меняются. Признаки указанного времени запроса
+    сохраняются в полях time_specified_columns.
+
+    Параметры:
+    ----------
+    df : DataFrame
+        данные запроса и выдачи пользователя
 
-    # Время полёта
-    df['BackFlightTime'] = df['BackFlightTime'].values.astype('<m8[m]').astype(int)
-    df = df.drop_duplicates()
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        рабочая таблица с разобранными датами: неглубокая копия df,
+        столбцы которой можно заменять и добавлять, не меняя df
 
+    '''
+    df = df.copy(deep=False)
+    for column in datetime_features:
+        if not pd.api.types.is_datetime64_dtype(df[column]):
+            df[column] = pd.to_datetime(df[column], format=datetime_format)
+    df['RequestDepartureTimeSpecified'] = is_time_specified(df['RequestDepartureDate'])
+    df['RequestReturnTimeSpecified'] = is_time_specified(df['RequestReturnDate'])
     return df
 
 
+def _get_delta_minutes(date_from, date_to):
+    '''Модуль разницы дат в минутах.'''
+    return (date_to - date_from).abs().to_numpy().astype('<m8[m]').astype(float)
+
+
 def get_difference_request_time(df):
     '''Функция для вычисления разницы от запрошенной даты и времени пользователем и выданным временем.
     ==================================================================================================
 
+    Разница считается только для запросов с указанным временем, даты
+    должны быть разобраны normalize_datetimes.
+
     Параметры:
     ----------
     df : DataFrame
@@ -363,59 +397,50 @@ def get_difference_request_time(df):
         с новыми полями FwdDepDelta и BackDepDelta
 
     '''
-    # Отсечение запросов без времени
-    df_with_time = df.loc[~(df['RequestDepartureDate'].str.contains('00:00:00.000', na=False))]
+    for column, request_column, time_specified_column, departure_column in [
+        ('FwdDepDelta', 'RequestDepartureDate', 'RequestDepartureTimeSpecified', 'DepartureDate'),
+        ('BackDepDelta', 'RequestReturnDate', 'RequestReturnTimeSpecified', 'ReturnDepatrureDate'),
+    ]:
+        if time_specified_column in df:
+            time_specified = df[time_specified_column].to_numpy()
+        else:
+            time_specified = is_time_specified(df[request_column]).to_numpy()
+
+        # Разница в минутах для запросов с указанным временем
+        delta = _get_delta_minutes(df[request_column], df[departure_column])
+        df[column] = _to_int_if_complete(np.where(time_specified, delta, np.nan))
 
-    df_with_time['RequestDepartureDate'] = df_with_time['RequestDepartureDate'].astype("datetime64[ns]")
-    df_with_time['DepartureDate'] = df_with_time['DepartureDate'].astype("datetime64[ns]")
-
-    # Нахождение разницы
-    df_with_time.loc[
-        df_with_time['RequestDepartureDate'] >= df_with_time['DepartureDate'], 'FwdDepDelta'
-        ] = df_with_time.apply(lambda x: x['RequestDepartureDate'] - x['DepartureDate'], axis=1)
-    df_with_time.loc[
-        df_with_time['RequestDepartureDate'] <= df_with_time['DepartureDate'], 'FwdDepDelta'
-        ] = df_with_time.apply(lambda x: x['DepartureDate'] - x['RequestDepartureDate'], axis=1)
-    
-    # Перевод в минуты
-    df_with_time['FwdDepDelta'] = df_with_time['FwdDepDelta'].values.astype('<m8[m]').astype(int)
-
-    # Объединение
-    df = df.merge(df_with_time[['FwdDepDelta']], left_index=True, right_index=True, how='left')
+    return df
 
 
-    # Отсечение пустых запросов
-    df_without_nan = df.loc[df['RequestReturnDate'].notna()]
+def get_days_before_departure(df):
+    '''Функция для вычисления разницы от дня покупки до дня вылета.
+    ===============================================================
 
-    # Отсечение запросов без времени
-    df_with_time = df_without_nan.loc[~(df_without_nan['RequestReturnDate'].str.contains('00:00:00.000', na=False))]
+    Параметры:
+    ----------
+    df : DataFrame
+        данные запроса и выдачи пользователя, даты разобраны normalize_datetimes
 
-    df_with_time['RequestReturnDate'] = df_with_time['RequestReturnDate'].astype("datetime64[ns]")
-    df_with_time['ReturnDepatrureDate'] = df_with_time['ReturnDepatrureDate'].astype("datetime64[ns]")
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        с новыми полями RequestDelta
 
+    '''
     # Нахождение разницы
-    df_with_time.loc[
-        df_with_time['RequestReturnDate'] >= df_with_time['ReturnDepatrureDate'], 'BackDepDelta'
-        ] = df_with_time.apply(lambda x: x['RequestReturnDate'] - x['ReturnDepatrureDate'], axis=1)
-    df_with_time.loc[
-        df_with_time['RequestReturnDate'] <= df_with_time['ReturnDepatrureDate'], 'BackDepDelta'
-        ] = df_with_time.apply(lambda x: x['ReturnDepatrureDate'] - x['RequestReturnDate'], axis=1)
-    
-    # Убираем пустые значения
-    df_with_time = df_with_time[df_with_time['BackDepDelta'].notna()]
-
-    # Перевод в минуты
-    df_with_time['BackDepDelta'] = df_with_time['BackDepDelta'].values.astype('<m8[m]').astype(int)
-
-    # Объединение
-    df = df.merge(df_with_time[['BackDepDelta']], left_index=True, right_index=True, how='left')
+    delta = df['RequestDepartureDate'] - df['RequestDate']
+    delta = delta.where(df['RequestDepartureDate'] >= df['RequestDate'])
+
+    # Перевод в сутки
+    df['RequestDelta'] = np.round(delta.to_numpy().astype('<m8[m]').astype(int) / 1140)
 
     return df
 
 
-def get_days_before_departure(df):
-    '''Функция для вычисления разницы от дня покупки до дня вылета.
-    ===============================================================
+def get_request_deltas(df):
+    '''Функция для вычисления отличий от лучших предложений запроса.
+    ================================================================
 
     Параметры:
     ----------
@@ -425,28 +450,73 @@ def get_days_before_departure(df):
     Возвращаемые значения:
     ----------------------
     df : DataFrame
-        с новыми полями RequestDelta
+        с новыми полями FlightTimeTotal, DeltaAmount, DeltaFlightTime
 
     '''
-    # Отсечение запросов без времени
+    # Время между перелётом туда и обратно
+    df['FlightTimeTotal'] = df['FwdFlightTime'].fillna(0.0) + df['BackFlightTime'].fillna(0.0)
 
-    df['RequestDepartureDate'] = df['RequestDepartureDate'].astype("datetime64[ns]")
-    df['RequestDate'] = df['RequestDate'].astype("datetime64[ns]")
+    # Разница от минимальной стоимости и быстрого времени
+    groups = df.groupby('RequestID', sort=False)
+    df['DeltaAmount'] = (groups['Amount'].transform('min') - df['Amount']).abs()
+    df['DeltaFlightTime'] = (groups['FlightTimeTotal'].transform('min') - df['FlightTimeTotal']).abs()
 
-    # Нахождение разницы
-    df.loc[
-        df['RequestDepartureDate'] >= df['RequestDate'], 'RequestDelta'
-        ] = df.apply(lambda x: x['RequestDepartureDate'] - x['RequestDate'], axis=1)
-    
-    # Перевод в сутки
-    df['RequestDelta'] = df['RequestDelta'].values.astype('<m8[m]').astype(int) / 1140
-    df = df.round({'RequestDelta': 0})
+    # RequestID последним столбцом, как в выгрузках результата
+    df['RequestID'] = df.pop('RequestID')
 
     return df
 
 
+def _downcast(values, int_dtype):
+    '''Целые числа без пропусков в int_dtype, остальные в float32.'''
+    values = np.asarray(values)
+    if values.dtype.kind in 'iub':
+        is_integer = True
+    else:
+        values = values.astype(float)
+        is_integer = not np.isnan(values).any() and np.array_equal(values, np.round(values))
+    if is_integer and len(values):
+        limits = np.iinfo(int_dtype)
+        is_integer = limits.min <= values.min() and values.max() <= limits.max
+    if is_integer:
+        return values.astype(int_dtype)
+    return values.astype(np.float32)
+
+
+def make_compact(df):
+    '''Функция перевода признаков в компактные типы.
+    ================================================
 
-def make_preprocess(df):
+    Коды, маршруты и варианты перелёта переводятся в category, флаги
+    в int8, количества, минуты и стоимости в int32 или float32, если
+    есть пропуски или дробная часть. Модель считает признаки в float32,
+    поэтому предсказания не меняются.
+
+    Параметры:
+    ----------
+    df : DataFrame
+        результат make_preprocess
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        те же строки и столбцы в компактных типах
+
+    '''
+    df = df.copy(deep=False)
+    for column in compact_categorical_columns:
+        if column in df:
+            df[column] = df[column].astype('category')
+    for column in compact_flag_columns:
+        if column in df:
+            df[column] = _downcast(df[column], np.int8)
+    for column in compact_numerical_columns:
+        if column in df:
+            df[column] = _downcast(df[column], np.int32)
+    return df
+
+
+def make_preprocess(df, stats=None, compact=False, time_zone_dictionary=None):
     '''Функция добавляет все необходимые столбцы для предсказания в модели.
     =======================================================================
 
@@ -454,79 +524,49 @@ def make_preprocess(df):
     ----------
     df : DataFrame
         данные запроса и выдачи пользователя
+    stats : PipelineStats
+        объект для замеров времени, строк и памяти по стадиям
+    compact : bool
+        вернуть признаки в компактных типах, см. make_compact
+    time_zone_dictionary : Series
+        справочник часовых поясов, по умолчанию из resources
 
     Возвращаемые значения:
     ----------------------
     df : DataFrame
-        с добавлением новых столбцов
+        с добавлением новых столбцов; при неверных датах, маршрутах
+        или типах столбцов - исключение InvalidOffersError
 
     '''
-    # Выделение столбцов
-    all_columns = [
-        'ID', 'RequestID', 'EmployeeId', 'RequestDate', 'ClientID', 'ValueRu', 
-        'RequestDepartureDate', 'RequestReturnDate', 'FligtOption', 'DepartureDate',
-        'ArrivalDate', 'ReturnDepatrureDate', 'ReturnDepatrureDate', 'SegmentCount',
-        'Amount', 'class', 'IsBaggage', 'isRefundPermitted', 'isRefundPermitted', 'isDiscount',
-        'InTravelPolicy', 'ReturnArrivalDate', 'isExchangePermitted', 'SearchRoute'
-    ]
-    datetime_features = [
-        'RequestDate',
-        'RequestDepartureDate',
-        'RequestReturnDate',
-        'DepartureDate',
-        'ArrivalDate',
-        'ReturnDepatrureDate',
-        'ReturnArrivalDate'
-    ]
-    numerical_features = [
-        'SegmentCount',
-        'Amount',
-        'IsBaggage',
-        'isRefundPermitted',
-        'isExchangePermitted',
-        'isDiscount',
-        'InTravelPolicy'
-    ]
-
-    df_fwd_flight_time = get_fwd_flight_time(df, all_columns)
-    all_columns = all_columns + ['FwdFrom', 'FwdTo']
-    df = df.merge(
-        df_fwd_flight_time,
-        left_on=all_columns,
-        right_on=all_columns,
-        how="left"
-    )
+    if time_zone_dictionary is None:
+        time_zone_dictionary = resources.time_zone_dictionary
 
-    df_back_fligh_time = get_back_fligh_time(df, all_columns)
-    all_columns = all_columns + ['FwdFlightTime', 'BackFrom', 'BackTo']
-    df = df.merge(
-        df_back_fligh_time,
-        left_on=all_columns,
-        right_on=all_columns,
-        how="left"
-    )
-    
-    df = get_difference_request_time(df)
-    df = get_days_before_departure(df)
+    stats = get_stats(stats)
 
-    # Время между перелётом туда и обратно
-    df['FlightTimeTotal'] = df['FwdFlightTime'].fillna(0.0) + df['BackFlightTime'].fillna(0.0)
+    n_rows = len(df)
+    try:
+        df = run_stage(stats, 'normalize_datetimes', normalize_datetimes, df)
 
-    df = df.reset_index()
-    df_request = df['RequestID'].copy()
-    df = df.set_index('RequestID')
+        routes = run_stage(stats, 'parse_routes', parse_routes, df['SearchRoute'])
+        df = run_stage(stats, 'get_fwd_flight_time', get_fwd_flight_time, df, time_zone_dictionary, routes)
+        df = run_stage(stats, 'get_back_fligh_time', get_back_fligh_time, df, time_zone_dictionary, routes)
 
-    # Разница от минимальной стоимости
-    df['DeltaAmount'] = df.groupby(level=0)['Amount'].min()
-    df['DeltaAmount'] -= df['Amount']
-    df['DeltaAmount'] = df['DeltaAmount'].abs()
+        # Индекс результата - номера строк
+        df.index = pd.RangeIndex(len(df), name='index')
 
-    # Разница от быстрого времени
-    df['DeltaFlightTime'] = df.groupby(level=0)['FlightTimeTotal'].min()
-    df['DeltaFlightTime'] -= df['FlightTimeTotal']
-    df['DeltaFlightTime'] = df['DeltaFlightTime'].abs()
+        df = run_stage(stats, 'get_difference_request_time', get_difference_request_time, df)
+        df = run_stage(stats, 'get_days_before_departure', get_days_before_departure, df)
+        df = run_stage(stats, 'get_request_deltas', get_request_deltas, df)
+        for column in time_specified_columns:
+            del df[column]
+        if compact:
+            df = run_stage(stats, 'make_compact', make_compact, df)
+    except (ValueError, TypeError) as error:
+        # Неверные даты, маршруты и типы столбцов во входных данных
+        raise InvalidOffersError(str(error)) from error
 
-    df = df.set_index('index')
-    df['RequestID'] = df_request
+    # Каждой входной строке соответствует ровно одна выходная
+    if len(df) != n_rows:
+        raise RuntimeError(f'Preprocessing returned {len(df)} rows for {n_rows} input rows')
 
-    return df
\ No newline at end of file
+    return df
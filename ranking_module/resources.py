@@ -0,0 +1,395 @@
+'''
+Модуль ленивой загрузки модели и словарей.
+==========================================
+
+Импорт модуля ничего не загружает: модель и словари читаются при первом
+обращении. Для многопроцессного сервера ресурсы можно загрузить заранее
+вызовом resources.warm_up() до запуска дочерних процессов.
+
+Изменённые файлы модели и словаря перечитываются вызовом
+resources.reload() или фоновым потоком resources.watch(interval):
+новая версия загружается целиком и подменяет старую под блокировкой.
+Пачка, взявшая resources.snapshot(), до конца работает со своей версией.
+
+Функции:
+--------
+load_model(path_model) `->` CatBoostClassifier
+convert_model(path_model, path_model_cbm) `->` Path
+
+Классы:
+-------
+Resources
+\nResourceSnapshot
+
+Переменные:
+-----------
+base_path `->` каталог модуля, относительно него ищутся файлы
+\nname_model `->` название ml модели в формате pickle
+\nname_model_cbm `->` название ml модели в формате CatBoost, используется, если файл есть
+\nname_file_dictionary `->` название словаря городов и аэропортов
+\nresources `->` общий экземпляр Resources
+
+Переменные окружения:
+---------------------
+RANKING_MODEL_PATH `->` путь до модели в формате pkl или cbm
+\nRANKING_DICTIONARY_PATH `->` путь до словаря в формате xlsx
+\nRANKING_THREAD_COUNT `->` число потоков модели, по умолчанию все ядра
+
+Зависимости:
+------------
+argparse
+\ncatboost
+\ncollections
+\ndatetime
+\njoblib
+\nlogging
+\nos
+\npathlib
+\nthreading
+
+Запуск:
+-------
+`python ranking_module/resources.py convert-model` конвертирует
+модель из pickle в формат CatBoost cbm рядом с исходным файлом
+
+'''
+
+
+# Необходимые библиотеки
+import argparse
+from collections import namedtuple
+from datetime import datetime
+import joblib
+import logging
+import os
+from pathlib import Path
+import threading
+## Внутренние файлы
+from dictionaries import load_dictionaries, make_time_zone_dictionary
+
+
+# Переменные
+logger = logging.getLogger(__name__)
+
+base_path = Path(__file__).resolve().parent
+name_model = 'ranking_model_catb_2500_cw1.5_0.84.pkl'
+name_model_cbm = 'ranking_model_catb_2500_cw1.5_0.84.cbm'
+name_file_dictionary = 'Locations_UTC.xlsx'
+
+# Согласованная версия ресурсов для одной пачки
+ResourceSnapshot = namedtuple('ResourceSnapshot', ['version', 'model', 'time_zone_dictionary'])
+
+
+def load_model(path_model):
+    '''Функция загрузки модели.
+    ===========================
+
+    Параметры:
+    ----------
+    path_model : str или Path
+        путь до модели в формате CatBoost (.cbm) или pickle
+
+    Возвращаемые значения:
+    ----------------------
+    model : CatBoostClassifier
+        обученная модель
+
+    '''
+    if Path(path_model).suffix.lower() == '.cbm':
+        # catboost импортируется только при загрузке модели
+        from catboost import CatBoostClassifier
+
+        model = CatBoostClassifier()
+        model.load_model(str(path_model), format='cbm')
+        return model
+    return joblib.load(path_model)
+
+
+def convert_model(path_model, path_model_cbm=None):
+    '''Функция конвертации модели из pickle в формат CatBoost.
+    ==========================================================
+
+    Параметры:
+    ----------
+    path_model : str или Path
+        путь до модели в формате pickle
+    path_model_cbm : str или Path
+        путь до модели в формате cbm, по умолчанию рядом с исходной
+
+    Возвращаемые значения:
+    ----------------------
+    Path
+        путь до модели в формате cbm
+
+    '''
+    if path_model_cbm is None:
+        path_model_cbm = Path(path_model).with_suffix('.cbm')
+    model = joblib.load(path_model)
+    model.save_model(str(path_model_cbm), format='cbm')
+    return Path(path_model_cbm)
+
+
+def _get_stamp(path):
+    '''Время изменения и размер файла, None, если файла нет.'''
+    try:
+        stat = Path(path).stat()
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _format_stamp(stamp):
+    '''Время изменения файла в формате ISO.'''
+    if stamp is None:
+        return None
+    return datetime.fromtimestamp(stamp[0] / 1e9).isoformat(timespec='seconds')
+
+
+def _get_default_model_path():
+    '''Модель в формате cbm, если она сконвертирована, иначе pickle.'''
+    if (base_path / name_model_cbm).exists():
+        return base_path / name_model_cbm
+    return base_path / name_model
+
+
+class Resources:
+    '''Реестр модели и словарей с загрузкой при первом обращении.
+    =============================================================
+
+    Параметры:
+    ----------
+    path_model : str или Path
+        путь до модели, по умолчанию RANKING_MODEL_PATH или файл рядом с модулем
+    path_dictionary : str или Path
+        путь до словаря, по умолчанию RANKING_DICTIONARY_PATH или файл рядом с модулем
+    thread_count : int
+        число потоков модели, по умолчанию RANKING_THREAD_COUNT или -1 (все ядра)
+
+    Атрибуты:
+    ---------
+    version : int
+        номер версии ресурсов, увеличивается при каждой подмене в reload
+
+    '''
+
+    def __init__(self, path_model=None, path_dictionary=None, thread_count=None):
+        self.path_model = Path(
+            path_model or os.environ.get('RANKING_MODEL_PATH') or _get_default_model_path()
+        )
+        self.path_dictionary = Path(
+            path_dictionary or os.environ.get('RANKING_DICTIONARY_PATH') or base_path / name_file_dictionary
+        )
+        self.thread_count = int(
+            thread_count or os.environ.get('RANKING_THREAD_COUNT') or -1
+        )
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        self._model = None
+        self._dictionaries = None
+        self._time_zone_dictionary = None
+        self._model_stamp = None
+        self._dictionary_stamp = None
+        self._failed_stamps = None
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        self.version = 1
+        self.reload_errors = 0
+
+    @property
+    def model(self):
+        '''Обученная модель CatBoostClassifier.'''
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # Отметка файла до чтения: изменение во время чтения заметит следующий reload
+                    self._model_stamp = _get_stamp(self.path_model)
+                    self._model = load_model(self.path_model)
+        return self._model
+
+    @property
+    def dictionaries(self):
+        '''Словари городов и аэропортов (df_city, df_airport).'''
+        if self._dictionaries is None:
+            with self._lock:
+                if self._dictionaries is None:
+                    self._dictionary_stamp = _get_stamp(self.path_dictionary)
+                    self._dictionaries = load_dictionaries(self.path_dictionary)
+        return self._dictionaries
+
+    @property
+    def time_zone_dictionary(self):
+        '''Справочник часовых поясов по IATA коду.'''
+        if self._time_zone_dictionary is None:
+            with self._lock:
+                if self._time_zone_dictionary is None:
+                    self._time_zone_dictionary = make_time_zone_dictionary(*self.dictionaries)
+        return self._time_zone_dictionary
+
+    @property
+    def is_ready(self):
+        '''Загружены ли модель и словари.'''
+        return self._model is not None and self._time_zone_dictionary is not None
+
+    def warm_up(self, model=True, dictionaries=True):
+        '''Загрузка ресурсов заранее.
+        =============================
+
+        Параметры:
+        ----------
+        model : bool
+            загрузить модель
+        dictionaries : bool
+            загрузить словари и справочник часовых поясов
+
+        Возвращаемые значения:
+        ----------------------
+        self : Resources
+
+        '''
+        if dictionaries:
+            self.time_zone_dictionary
+        if model:
+            self.model
+        return self
+
+    def snapshot(self):
+        '''Функция получения согласованной версии ресурсов.
+        ===================================================
+
+        Возвращаемые значения:
+        ----------------------
+        ResourceSnapshot
+            version, model и time_zone_dictionary одной версии, не меняются
+            при последующих reload
+
+        '''
+        self.warm_up()
+        with self._lock:
+            return ResourceSnapshot(self.version, self._model, self._time_zone_dictionary)
+
+    def reload(self, force=False):
+        '''Функция перезагрузки изменённых модели и словаря.
+        ====================================================
+
+        Проверяются только уже загруженные ресурсы. Новая версия читается
+        без блокировки и подменяет старую целиком, ошибка загрузки
+        записывается в лог, старая версия остаётся.
+
+        Параметры:
+        ----------
+        force : bool
+            перечитать загруженные файлы, даже если они не менялись
+
+        Возвращаемые значения:
+        ----------------------
+        bool
+            True, если версия подменена
+
+        '''
+        with self._reload_lock:
+            model_stamp = _get_stamp(self.path_model)
+            dictionary_stamp = _get_stamp(self.path_dictionary)
+            reload_model = self._model is not None and (force or model_stamp != self._model_stamp)
+            reload_dictionary = self._dictionaries is not None and (force or dictionary_stamp != self._dictionary_stamp)
+            if not reload_model and not reload_dictionary:
+                return False
+            # Файлы, которые не удалось загрузить, ждут следующего изменения
+            if not force and (model_stamp, dictionary_stamp) == self._failed_stamps:
+                return False
+
+            try:
+                model = load_model(self.path_model) if reload_model else None
+                if reload_dictionary:
+                    dictionaries = load_dictionaries(self.path_dictionary)
+                    time_zone_dictionary = make_time_zone_dictionary(*dictionaries)
+            except Exception:
+                self.reload_errors += 1
+                self._failed_stamps = (model_stamp, dictionary_stamp)
+                logger.exception(f'Resources reload failed, keeping version {self.version}')
+                return False
+
+            with self._lock:
+                if reload_model:
+                    self._model = model
+                    self._model_stamp = model_stamp
+                if reload_dictionary:
+                    self._dictionaries = dictionaries
+                    self._time_zone_dictionary = time_zone_dictionary
+                    self._dictionary_stamp = dictionary_stamp
+                self.version += 1
+            logger.info(
+                f'Resources version {self.version}: model {self.path_model} ({_format_stamp(self._model_stamp)}), '
+                f'dictionary {self.path_dictionary} ({_format_stamp(self._dictionary_stamp)})'
+            )
+            return True
+
+    def watch(self, interval=30.0):
+        '''Функция запуска фоновой проверки файлов.
+        ===========================================
+
+        Параметры:
+        ----------
+        interval : float
+            период проверки в секундах
+
+        Возвращаемые значения:
+        ----------------------
+        Thread
+            поток проверки, останавливается stop_watching
+
+        '''
+        if self._watcher is not None and self._watcher.is_alive():
+            return self._watcher
+
+        def run():
+            while not self._stop_watching.wait(interval):
+                self.reload()
+
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=run, name='resources-watcher', daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def stop_watching(self):
+        '''Остановка фоновой проверки файлов.'''
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+
+    def get_metrics(self):
+        '''Метрики версии ресурсов.
+        ===========================
+
+        Возвращаемые значения:
+        ----------------------
+        dict
+            version, model_path, model_modified, dictionary_path,
+            dictionary_modified - время изменения загруженных файлов,
+            reload_errors - число неудачных перезагрузок
+
+        '''
+        return {
+            'version': self.version,
+            'model_path': str(self.path_model),
+            'model_modified': _format_stamp(self._model_stamp),
+            'dictionary_path': str(self.path_dictionary),
+            'dictionary_modified': _format_stamp(self._dictionary_stamp),
+            'reload_errors': self.reload_errors,
+        }
+
+
+# Общий экземпляр для модулей пакета
+resources = Resources()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Работа с моделью ранжирования')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_convert = subparsers.add_parser('convert-model', help='конвертация модели из pickle в cbm')
+    parser_convert.add_argument('model', nargs='?', default=str(base_path / name_model), help='путь до модели в формате pickle')
+    parser_convert.add_argument('output', nargs='?', default=None, help='путь до модели в формате cbm')
+    args = parser.parse_args()
+
+    path_model_cbm = convert_model(args.model, args.output)
+    print(f'Модель сохранена: {path_model_cbm}')
@@ -0,0 +1,216 @@
+'''
+Модуль кэша оценок модели.
+==========================
+
+Повторные поиски дают те же строки признаков модели: оценка такой
+строки не меняется, пока не сменилась модель. Кэш хранит вероятность
+по версии модели и отпечатку строки used_features
+(pd.util.hash_pandas_object) и ограничен по числу записей (LRU):
+оценки другой версии модели не выдаются, а вытесняются как давно
+не использованные.
+
+Функции:
+--------
+get_row_keys(X) `->` ndarray
+get_model_version(model) `->` tuple
+
+Классы:
+-------
+ScoreCache
+
+Переменные:
+-----------
+model_versions `->` номера моделей без явной версии по id модели
+
+Зависимости:
+------------
+collections
+\nitertools
+\npandas
+\nthreading
+\ntime
+\nweakref
+
+'''
+
+
+# Необходимые библиотеки
+from collections import OrderedDict
+import itertools
+import pandas as pd
+import threading
+import time
+import weakref
+
+
+# Переменные
+# Номер модели по id модели, запись удаляется вместе с моделью, поэтому номер не переиспользуется
+model_versions = {}
+_model_numbers = itertools.count(1)
+
+
+def get_row_keys(X):
+    '''Функция вычисления отпечатков строк признаков.
+    =================================================
+
+    Параметры:
+    ----------
+    X : DataFrame
+        признаки модели из get_model_features
+
+    Возвращаемые значения:
+    ----------------------
+    ndarray
+        uint64 хэш значений каждой строки без учёта индекса
+
+    '''
+    return pd.util.hash_pandas_object(X, index=False).to_numpy()
+
+
+def get_model_version(model):
+    '''Функция получения версии модели для кэша оценок.
+    ===================================================
+
+    Для модели без явной версии: номер уникален в пределах процесса
+    и не достаётся новой модели, даже если она получит тот же id.
+
+    Параметры:
+    ----------
+    model : CatBoostClassifier
+        обученная модель
+
+    Возвращаемые значения:
+    ----------------------
+    tuple
+        ('model', номер), не совпадает с resources.version
+
+    '''
+    version = model_versions.get(id(model))
+    if version is None:
+        # Модель CatBoost не хэшируется, запись удаляется при сборке модели
+        version = model_versions[id(model)] = ('model', next(_model_numbers))
+        weakref.finalize(model, model_versions.pop, id(model), None)
+    return version
+
+
+class ScoreCache:
+    '''Ограниченный LRU/TTL кэш оценок модели.
+    ==========================================
+
+    Версия модели передаётся в get_many и put_many и входит в ключ
+    записи: resources.version, версия, заданная вызывающим кодом,
+    или get_model_version.
+
+    Параметры:
+    ----------
+    max_size : int
+        максимальное число записей, при переполнении удаляются
+        давно не использованные
+    ttl : float
+        время жизни записи в секундах, None - без ограничения
+
+    '''
+
+    def __init__(self, max_size=100000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def hit_rate(self):
+        '''Доля попаданий среди всех обращений.'''
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        '''Удаление всех записей.'''
+        with self._lock:
+            self._items.clear()
+
+    def get_many(self, keys, model_version):
+        '''Поиск оценок по ключам.
+        ==========================
+
+        Параметры:
+        ----------
+        keys : iterable
+            отпечатки строк из get_row_keys
+        model_version : hashable
+            версия модели, которой считаются оценки
+
+        Возвращаемые значения:
+        ----------------------
+        list
+            оценки для найденных ключей, None для ненайденных
+
+        '''
+        now = time.monotonic()
+        values = []
+        with self._lock:
+            for key in keys:
+                key = (model_version, key)
+                item = self._items.get(key)
+                if item is not None and self.ttl is not None and item[1] < now:
+                    del self._items[key]
+                    self.expirations += 1
+                    item = None
+                if item is None:
+                    self.misses += 1
+                    values.append(None)
+                else:
+                    self.hits += 1
+                    self._items.move_to_end(key)
+                    values.append(item[0])
+        return values
+
+    def put_many(self, keys, values, model_version):
+        '''Сохранение оценок по ключам.
+        ===============================
+
+        Параметры:
+        ----------
+        keys : iterable
+            отпечатки строк из get_row_keys
+        values : iterable
+            оценки в том же порядке
+        model_version : hashable
+            версия модели, которой посчитаны оценки
+
+        '''
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            for key, value in zip(keys, values):
+                key = (model_version, key)
+                self._items[key] = (value, expires)
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def get_metrics(self):
+        '''Метрики кэша.
+        ================
+
+        Возвращаемые значения:
+        ----------------------
+        dict
+            size, hits, misses, hit_rate, evictions - удалено при переполнении,
+            expirations - удалено по времени жизни
+
+        '''
+        return {
+            'size': len(self._items),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
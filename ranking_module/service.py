@@ -0,0 +1,311 @@
+'''
+Модуль HTTP сервиса ранжирования предложений.
+=============================================
+
+Сервис держит модель и словари загруженными и ранжирует предложения
+одного или нескольких запросов, переданные в формате JSON или CSV.
+
+Запросы:
+--------
+GET /health `->` процесс жив
+\nGET /ready `->` модель и словари загружены
+\nGET /metrics `->` метрики очереди микро-батчинга, кэша оценок и версия модели и словарей
+\nPOST /rank `->` позиции предложений в порядке входных строк,
+с параметром ?top_k=K только первые K предложений каждого запроса
+
+Тело POST /rank: список предложений в JSON (или {"offers": [...]})
+с Content-Type application/json, либо таблица с Content-Type text/csv.
+Ответ: {"positions": [{"ID": ..., "RequestID": ..., "Position": ...}, ...]}
+
+Функции:
+--------
+read_offers(body, content_type) `->` df
+rank_offers(df, model, latency_budget, score_cache) `->` df
+make_server(host, port, batch_window, max_batch_size, latency_budget, score_cache_size, reload_interval) `->` ThreadingHTTPServer
+
+Зависимости:
+------------
+argparse
+\nasyncio
+\nconcurrent.futures
+\nhttp.server
+\nio
+\njson
+\nlogging
+\npandas
+\nthreading
+\nurllib
+
+Запуск:
+-------
+`python ranking_module/service.py --host 127.0.0.1 --port 8080`
+
+'''
+
+
+# Необходимые библиотеки
+import argparse
+import asyncio
+import concurrent.futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import io
+import json
+import logging
+import pandas as pd
+import threading
+from urllib.parse import parse_qs, urlsplit
+## Внутренние файлы
+from batching import MicroBatchScheduler
+from main import make_preds
+from preprocessing import InvalidOffersError, make_preprocess
+from resources import resources
+from score_cache import ScoreCache
+
+
+# Переменные
+logger = logging.getLogger(__name__)
+
+result_columns = ['ID', 'RequestID', 'Position']
+# Максимальное время ожидания результата микро-батчинга в секундах
+rank_timeout = 60.0
+
+
+def read_offers(body, content_type):
+    '''Функция чтения предложений из тела запроса.
+    ==============================================
+
+    Параметры:
+    ----------
+    body : bytes
+        тело запроса
+    content_type : str
+        тип содержимого, application/json или text/csv
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        данные запроса и выдачи пользователя
+
+    '''
+    content_type = (content_type or 'application/json').split(';')[0].strip().lower()
+
+    if content_type == 'text/csv':
+        df = pd.read_csv(io.BytesIO(body))
+    elif content_type == 'application/json':
+        offers = json.loads(body)
+        if isinstance(offers, dict):
+            offers = offers.get('offers')
+        if not isinstance(offers, list):
+            raise ValueError('Expected a list of offers')
+        df = pd.DataFrame.from_records(offers)
+    else:
+        raise ValueError(f'Unsupported content type: {content_type}')
+
+    if df.empty:
+        raise ValueError('No offers in request')
+
+    return df.drop(columns=['Position ( from 1 to n)'], errors='ignore')
+
+
+def rank_offers(df, model=None, latency_budget=None, score_cache=None):
+    '''Функция ранжирования предложений.
+    ====================================
+
+    Параметры:
+    ----------
+    df : DataFrame
+        данные запроса и выдачи пользователя
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    latency_budget : float
+        бюджет времени на оценку моделью в секундах, None - все деревья
+    score_cache : ScoreCache
+        кэш оценок модели
+
+    Возвращаемые значения:
+    ----------------------
+    df : DataFrame
+        с полями ID, RequestID, Position в порядке входных строк
+
+    '''
+    # Версия ресурсов фиксируется на весь запрос
+    time_zone_dictionary, model_version = None, None
+    if model is None:
+        snapshot = resources.snapshot()
+        model, time_zone_dictionary = snapshot.model, snapshot.time_zone_dictionary
+        model_version = snapshot.version
+    processed_df = make_preprocess(df, time_zone_dictionary=time_zone_dictionary)
+    df_result = make_preds(
+        processed_df, model, latency_budget=latency_budget, score_cache=score_cache, model_version=model_version
+    )
+    return df_result[result_columns]
+
+
+class RankingHandler(BaseHTTPRequestHandler):
+    '''Обработчик запросов сервиса ранжирования.'''
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send_json(self, status, payload):
+        body = payload.encode('utf-8') if isinstance(payload, str) else json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            metrics = self.server.scheduler.get_metrics() if self.server.scheduler is not None else {}
+            if self.server.score_cache is not None:
+                metrics['score_cache'] = self.server.score_cache.get_metrics()
+            metrics['resources'] = resources.get_metrics()
+            self._send_json(200, metrics)
+        elif self.path == '/ready':
+            if resources.is_ready:
+                self._send_json(200, {'status': 'ready'})
+            else:
+                self._send_json(503, {'status': 'loading'})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != '/rank':
+            self._send_json(404, {'error': 'Not found'})
+            return
+        if not resources.is_ready:
+            self._send_json(503, {'error': 'Service is not ready'})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+
+        try:
+            df = read_offers(body, self.headers.get('Content-Type'))
+            top_k = parse_qs(url.query).get('top_k')
+            top_k = int(top_k[0]) if top_k else None
+        except (ValueError, KeyError) as error:
+            self._send_json(400, {'error': str(error)})
+            return
+
+        try:
+            if self.server.scheduler is not None:
+                future = asyncio.run_coroutine_threadsafe(self.server.scheduler.rank(df), self.server.loop)
+                try:
+                    df_result = future.result(timeout=rank_timeout)
+                except concurrent.futures.TimeoutError:
+                    future.cancel()
+                    logger.error(f'Ranking timed out after {rank_timeout} s')
+                    self._send_json(504, {'error': 'Ranking timed out'})
+                    return
+            else:
+                df_result = rank_offers(
+                    df, latency_budget=self.server.latency_budget, score_cache=self.server.score_cache
+                )
+        except KeyError as error:
+            self._send_json(400, {'error': f'Missing column: {error}'})
+            return
+        except InvalidOffersError as error:
+            self._send_json(400, {'error': f'Invalid offers: {error}'})
+            return
+        except Exception:
+            logger.exception('Ranking failed')
+            self._send_json(500, {'error': 'Ranking failed'})
+            return
+
+        if top_k is not None:
+            df_result = df_result[df_result['Position'] <= top_k]
+        self._send_json(200, '{"positions": ' + df_result.to_json(orient='records') + '}')
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} - {format % args}')
+
+
+def _warm_up():
+    '''Загрузка ресурсов с записью ошибки в лог.'''
+    try:
+        resources.warm_up()
+        logger.info(f'Resources loaded, version {resources.version}')
+    except Exception:
+        logger.exception('Resources loading failed')
+
+
+def make_server(host='127.0.0.1', port=8080, batch_window=None, max_batch_size=2000,
+                latency_budget=None, score_cache_size=None, reload_interval=None):
+    '''Функция создания HTTP сервера.
+    =================================
+
+    Модель и словари загружаются в фоновом потоке, до окончания загрузки
+    /ready и /rank отвечают 503.
+
+    Параметры:
+    ----------
+    host : str
+        адрес сервера
+    port : int
+        порт сервера, 0 - любой свободный
+    batch_window : float
+        окно микро-батчинга в секундах, None - без объединения запросов
+    max_batch_size : int
+        максимальное число предложений в пачке
+    latency_budget : float
+        бюджет времени на оценку моделью в секундах, число деревьев
+        подбирается по прошлым запросам, None - все деревья
+    score_cache_size : int
+        число записей кэша оценок модели, None - без кэша
+    reload_interval : float
+        период проверки файлов модели и словаря в секундах, изменённые
+        файлы загружаются без остановки сервера; None - без проверки
+
+    Возвращаемые значения:
+    ----------------------
+    server : ThreadingHTTPServer
+        сервер, запускается методом serve_forever()
+
+    '''
+    server = ThreadingHTTPServer((host, port), RankingHandler)
+    server.scheduler = None
+    server.loop = None
+    server.latency_budget = latency_budget
+    server.score_cache = ScoreCache(score_cache_size) if score_cache_size else None
+    if batch_window is not None:
+        server.loop = asyncio.new_event_loop()
+        threading.Thread(target=server.loop.run_forever, name='batching', daemon=True).start()
+        server.scheduler = MicroBatchScheduler(
+            max_batch_size=max_batch_size, max_wait=batch_window, latency_budget=latency_budget,
+            score_cache=server.score_cache
+        )
+    threading.Thread(target=_warm_up, name='warm-up', daemon=True).start()
+    if reload_interval is not None:
+        resources.watch(reload_interval)
+    return server
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser(description='HTTP сервис ранжирования предложений')
+    parser.add_argument('--host', default='127.0.0.1', help='адрес сервера')
+    parser.add_argument('--port', type=int, default=8080, help='порт сервера')
+    parser.add_argument('--batch-window', type=float, default=None, help='окно микро-батчинга в секундах')
+    parser.add_argument('--max-batch-size', type=int, default=2000, help='максимальное число предложений в пачке')
+    parser.add_argument('--latency-budget', type=float, default=None, help='бюджет времени на оценку моделью в секундах')
+    parser.add_argument('--score-cache-size', type=int, default=None, help='число записей кэша оценок модели')
+    parser.add_argument('--reload-interval', type=float, default=None,
+                        help='период проверки файлов модели и словаря в секундах')
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port, args.batch_window, args.max_batch_size,
+        args.latency_budget, args.score_cache_size, args.reload_interval
+    )
+    logger.info(f'Serving on http://{args.host}:{server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -0,0 +1,135 @@
+'''
+Модуль инкрементального ранжирования запроса.
+=============================================
+
+Предложения одного RequestID приходят волнами. Сессия хранит признаки
+и оценки уже полученных предложений: для новой волны считаются только
+её признаки, отличия от минимальной стоимости и времени перелёта
+пересчитываются по всему запросу, а модель заново оценивает только
+новые предложения и строки, у которых эти отличия изменились.
+
+Классы:
+-------
+RankingSession
+
+Зависимости:
+------------
+numpy
+\npandas
+
+'''
+
+
+# Необходимые библиотеки
+import numpy as np
+import pandas as pd
+## Внутренние файлы
+from main import get_positions, get_scores
+from preprocessing import make_preprocess
+
+
+# Переменные
+delta_columns = {'DeltaAmount': 'Amount', 'DeltaFlightTime': 'FlightTimeTotal'}
+
+
+def _is_changed(old, new):
+    '''Изменившиеся значения, пропуски с обеих сторон считаются равными.'''
+    return ~((old == new) | (pd.isna(old) & pd.isna(new)))
+
+
+class RankingSession:
+    '''Сессия ранжирования предложений одного запроса.
+    ==================================================
+
+    Позиции после каждой волны совпадают с ранжированием всех полученных
+    предложений одним вызовом make_preprocess и make_preds.
+
+    Параметры:
+    ----------
+    model : CatBoostClassifier
+        обученная модель, по умолчанию из resources
+    thread_count : int
+        число потоков модели, по умолчанию resources.thread_count
+    score_cache : ScoreCache
+        кэш оценок модели, общий для сессий
+
+    '''
+
+    def __init__(self, model=None, thread_count=None, score_cache=None):
+        self.model = model
+        self.score_cache = score_cache
+        self.thread_count = thread_count
+        self.request_id = None
+        self.waves = 0
+        self.scored_rows = 0
+        self._df = None
+        self._scores = np.empty(0)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def add_offers(self, df):
+        '''Добавление волны предложений и ранжирование всего запроса.
+        ============================================================
+
+        Параметры:
+        ----------
+        df : DataFrame
+            новые предложения запроса в формате входного файла
+
+        Возвращаемые значения:
+        ----------------------
+        df : DataFrame
+            все предложения запроса в порядке поступления
+            с заполненным рейтингом ранжирования Position
+
+        '''
+        request_ids = df['RequestID'].unique()
+        if len(request_ids) != 1:
+            raise ValueError(f'Expected offers of one RequestID, got {len(request_ids)}')
+        if self.request_id is not None and request_ids[0] != self.request_id:
+            raise ValueError(f'Session of RequestID {self.request_id} got offers of RequestID {request_ids[0]}')
+        self.request_id = request_ids[0]
+
+        df_new = make_preprocess(df)
+
+        if self._df is None:
+            df_all = df_new
+            changed = np.ones(len(df_all), dtype=bool)
+        else:
+            n_old = len(self._df)
+            df_all = pd.concat([self._df, df_new], ignore_index=True)
+            df_all.index.name = 'index'
+
+            # Отличия от минимумов по всем предложениям запроса
+            changed = np.zeros(len(df_all), dtype=bool)
+            changed[n_old:] = True
+            for column, value_column in delta_columns.items():
+                delta = (df_all[value_column].min() - df_all[value_column]).abs()
+                changed[:n_old] |= _is_changed(df_all[column].to_numpy()[:n_old], delta.to_numpy()[:n_old])
+                df_all[column] = delta
+
+        # Оценка только новых и изменившихся предложений
+        scores = np.concatenate([self._scores, np.full(len(df_new), np.nan)])
+        rows = np.flatnonzero(changed)
+        scores[rows] = get_scores(df_all.iloc[rows], self.model, self.thread_count, score_cache=self.score_cache)
+
+        self._df = df_all
+        self._scores = scores
+        self.waves += 1
+        self.scored_rows += len(rows)
+
+        return df_all.assign(Position=get_positions(df_all['RequestID'].to_numpy(), scores))
+
+    def get_metrics(self):
+        '''Метрики сессии.
+        ==================
+
+        Возвращаемые значения:
+        ----------------------
+        dict
+            waves - число волн, offers - предложений в запросе,
+            scored_rows - строк, оценённых моделью за все волны
+
+        '''
+        return {'waves': self.waves, 'offers': len(self), 'scored_rows': self.scored_rows}
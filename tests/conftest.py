@@ -0,0 +1,16 @@
+'''
+Общие настройки тестов.
+=======================
+
+Модули ranking_module импортируют друг друга без пакета, поэтому
+каталог модуля добавляется в sys.path.
+
+'''
+
+
+# Необходимые библиотеки
+from pathlib import Path
+import sys
+
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'ranking_module'))
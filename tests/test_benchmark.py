@@ -0,0 +1,57 @@
+'''
+Тест пиковой памяти make_preprocess.
+====================================
+
+Пиковая память make_preprocess на синтетических предложениях
+замеряется tracemalloc и сверяется с бюджетом memory_budget
+через check_memory_budget; результат с compact=True должен занимать
+меньше памяти.
+
+Запуск:
+-------
+`python -m pytest tests`
+
+'''
+
+
+# Необходимые библиотеки
+import pytest
+import tracemalloc
+## Внутренние файлы
+from benchmark import check_memory_budget, make_synthetic_offers
+from preprocessing import make_preprocess
+
+
+def _measure_peak(df, compact):
+    '''Результат make_preprocess и его пиковая память в MB.'''
+    tracemalloc.start()
+    try:
+        df_result = make_preprocess(df, compact=compact)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return df_result, peak_memory / 2 ** 20
+
+
+@pytest.fixture(scope='module')
+def offers():
+    df = make_synthetic_offers(400, 50)
+    # Прогрев: справочник и разобранные маршруты не входят в замер
+    make_preprocess(df)
+    return df
+
+
+@pytest.mark.parametrize('compact', [False, True], ids=['plain', 'compact'])
+def test_make_preprocess_memory_budget(offers, compact):
+    _, peak_memory = _measure_peak(offers, compact)
+
+    result = {'results': [{'stage': 'make_preprocess', 'batch_size': len(offers), 'peak_memory_mb': peak_memory}]}
+    assert len(offers) >= 10000
+    assert check_memory_budget(result) == []
+
+
+def test_compact_result_is_smaller(offers):
+    df_plain = make_preprocess(offers)
+    df_compact = make_preprocess(offers, compact=True)
+
+    assert df_compact.memory_usage(deep=True).sum() < df_plain.memory_usage(deep=True).sum() / 2
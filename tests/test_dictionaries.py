@@ -0,0 +1,38 @@
+'''
+Тест загрузки словарей с пропущенными идентификаторами.
+=======================================================
+
+Город без Id и аэропорт без CityID не мешают собрать кэш словарей
+и справочник часовых поясов, при сборке и при чтении из кэша.
+
+Запуск:
+-------
+`python -m pytest tests`
+
+'''
+
+
+# Необходимые библиотеки
+import pandas as pd
+import pytest
+## Внутренние файлы
+from dictionaries import load_dictionaries, make_time_zone_dictionary
+
+
+def test_missing_ids(tmp_path):
+    name_file = tmp_path / 'Locations_UTC.xlsx'
+    with pd.ExcelWriter(name_file) as writer:
+        pd.DataFrame({
+            'Id': [1, None, 3],
+            'IataCode': ['MOW', 'LED', 'KZN'],
+            'TimeZone': [3.0, 3.0, 3.0],
+        }).to_excel(writer, sheet_name='City', index=False)
+        pd.DataFrame({
+            'IATACode': ['SVO', 'VKO', 'KZN'],
+            'CityID': [1, None, 3],
+        }).to_excel(writer, sheet_name='Airport', index=False)
+
+    # Первый вызов собирает кэш, второй читает его
+    for _ in range(2):
+        time_zone_dictionary = make_time_zone_dictionary(*load_dictionaries(name_file))
+        assert time_zone_dictionary.to_dict() == pytest.approx({'MOW': 3.0, 'LED': 3.0, 'KZN': 3.0, 'SVO': 3.0})
@@ -0,0 +1,59 @@
+'''
+Тесты подбора числа деревьев под бюджет времени.
+================================================
+
+Замеры record_tree_cost задаются по известной формуле
+fixed + row * n_rows + tree * n_rows * ntree_end, get_tree_limit
+должен выбирать число деревьев по ней.
+
+Запуск:
+-------
+`python -m pytest tests`
+
+'''
+
+
+# Необходимые библиотеки
+import pytest
+## Внутренние файлы
+from main import get_tree_limit, get_truncated_scores, record_tree_cost
+
+
+# Переменные
+fixed, row, tree = 2e-3, 1e-6, 1e-8
+
+
+class Model:
+    '''Модель с числом деревьев, без предсказаний.'''
+
+    tree_count_ = 1000
+
+
+def _seconds(n_rows, ntree_end):
+    return fixed + row * n_rows + tree * n_rows * ntree_end
+
+
+def test_small_truncated_call_does_not_disable_budget():
+    model = Model()
+    record_tree_cost(model, 5000, 0, _seconds(5000, 1000))
+    # Вызов на маленькой пачке почти целиком состоит из постоянной части
+    record_tree_cost(model, 10, 1, _seconds(10, 1))
+    record_tree_cost(model, 500, 100, _seconds(500, 100))
+
+    assert get_tree_limit(model, 5000, _seconds(5000, 1000) * 2) == 0
+    assert get_tree_limit(model, 5000, _seconds(5000, 400)) == pytest.approx(400, abs=1)
+    assert get_tree_limit(model, 5000, fixed) == 1
+
+
+def test_stale_samples_expire():
+    model = Model()
+    record_tree_cost(model, 5000, 0, _seconds(5000, 1000) * 10)
+    for n_rows, ntree_end in [(5000, 100), (1000, 500), (10, 1)] * 60:
+        record_tree_cost(model, n_rows, ntree_end, _seconds(n_rows, ntree_end))
+
+    assert get_tree_limit(model, 5000, _seconds(5000, 400)) == pytest.approx(400, abs=1)
+
+
+def test_refine_k_below_one():
+    with pytest.raises(ValueError):
+        get_truncated_scores(None, Model(), ntree_end=10, refine_k=0)
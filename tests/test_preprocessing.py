@@ -0,0 +1,66 @@
+'''
+Тесты соответствия строк make_preprocess.
+=========================================
+
+Каждой входной строке соответствует ровно одна выходная в том же
+порядке: для одинаковых предложений, пропусков в ключах предложения
+и пачек только из перелётов в одну сторону. Неверные входные данные
+дают InvalidOffersError.
+
+Запуск:
+-------
+`python -m pytest tests`
+
+'''
+
+
+# Необходимые библиотеки
+import numpy as np
+import pandas as pd
+import pytest
+## Внутренние файлы
+from benchmark import make_synthetic_offers
+from preprocessing import InvalidOffersError, make_preprocess
+
+
+def _identical_offers():
+    '''Каждое предложение повторено дважды подряд.'''
+    df = make_synthetic_offers(5, 4, seed=1)
+    return pd.concat([df, df], ignore_index=True).sort_values('RequestID', kind='stable', ignore_index=True)
+
+
+def _nan_keys():
+    '''Пропуски в маршруте, варианте перелёта и датах.'''
+    df = make_synthetic_offers(5, 4, seed=2)
+    df.loc[0, 'SearchRoute'] = np.nan
+    df.loc[1, 'FligtOption'] = np.nan
+    df.loc[2, ['DepartureDate', 'ArrivalDate']] = np.nan
+    df.loc[3, ['ReturnDepatrureDate', 'ReturnArrivalDate']] = np.nan
+    df.loc[4:6, 'SearchRoute'] = np.nan
+    return df
+
+
+def _one_way_only():
+    '''Пачка без перелётов обратно.'''
+    return make_synthetic_offers(5, 4, return_share=0.0, seed=3)
+
+
+@pytest.mark.parametrize('make_offers', [_identical_offers, _nan_keys, _one_way_only])
+@pytest.mark.parametrize('compact', [False, True], ids=['plain', 'compact'])
+def test_rows_match_input(make_offers, compact):
+    df = make_offers()
+
+    df_result = make_preprocess(df, compact=compact)
+
+    assert len(df_result) == len(df)
+    assert df_result['ID'].tolist() == df['ID'].tolist()
+    assert df_result['RequestID'].tolist() == df['RequestID'].tolist()
+
+
+@pytest.mark.parametrize('column, value', [('DepartureDate', 'not-a-date'), ('Amount', 'abc'), ('SearchRoute', ['MOW'])])
+def test_invalid_offers(column, value):
+    df = make_synthetic_offers(2, 3).astype({column: object})
+    df.at[0, column] = value
+
+    with pytest.raises(InvalidOffersError):
+        make_preprocess(df)
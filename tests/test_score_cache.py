@@ -0,0 +1,47 @@
+'''
+Тесты кэша оценок модели.
+=========================
+
+Оценки одной строки для разных версий модели не смешиваются,
+а номер модели без явной версии не достаётся новой модели.
+
+Запуск:
+-------
+`python -m pytest tests`
+
+'''
+
+
+# Необходимые библиотеки
+import gc
+## Внутренние файлы
+from score_cache import ScoreCache, get_model_version, model_versions
+
+
+class Model:
+    '''Объект вместо модели CatBoost.'''
+
+
+def test_versions_do_not_mix():
+    score_cache = ScoreCache()
+    score_cache.put_many([1, 2], [0.1, 0.2], 1)
+
+    assert score_cache.get_many([1, 2], 2) == [None, None]
+    assert score_cache.get_many([1, 2], 1) == [0.1, 0.2]
+    # Запись прежней версии после новой не вытесняет её оценки
+    score_cache.put_many([1], [0.9], 2)
+    score_cache.put_many([1], [0.3], 1)
+    assert score_cache.get_many([1], 2) == [0.9]
+
+
+def test_model_version_is_not_reused():
+    model = Model()
+    version = get_model_version(model)
+    assert get_model_version(model) == version
+
+    model_id = id(model)
+    del model
+    gc.collect()
+    # Новая модель с тем же id получит новый номер
+    assert model_id not in model_versions
+    assert get_model_version(Model()) != version